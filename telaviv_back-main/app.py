@@ -14,6 +14,9 @@ from mail_config import mail
 from dotenv import load_dotenv
 import os
 from nexti_api import nexti_bp
+from response_compression import compression
+from metrics import metrics_bp, request_metrics
+from db import close_request_connection
 
 
 
@@ -54,12 +57,23 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(
 # Inicialize o JWTManager
 jwt = JWTManager(app)
 
+# Compressão gzip/brotli das respostas grandes (relatórios da Nexti)
+compression.init_app(app)
+
+# Duração por rota e requisições em andamento (expostas em /metrics)
+request_metrics.init_app(app)
+
+# Uma conexão do banco por requisição, devolvida ao pool no fim dela
+app.teardown_appcontext(close_request_connection)
+
 # Registre os blueprints das rotas
 app.register_blueprint(login_candidato_bp)
 app.register_blueprint(recuperar_usuario_bp)
 app.register_blueprint(savenewpassword_bp)
 app.register_blueprint(usuario_bp)
 app.register_blueprint(nexti_bp)
+# Métricas no formato do Prometheus (GET /metrics; METRICS_TOKEN protege o endpoint)
+app.register_blueprint(metrics_bp)
 
 
 if __name__ == '__main__':
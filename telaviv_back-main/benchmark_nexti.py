@@ -0,0 +1,211 @@
+"""
+Benchmark de ponta a ponta do relatório da Nexti contra a Nexti simulada (nexti_mock.py).
+
+Para cada tamanho de tenant mede o relatório completo (_get_report): tempo de
+cada etapa (token, catálogos, sobrescritas históricas, detalhes, montagem),
+tempo total, linhas por segundo, requisições/bytes trafegados e pico de
+memória (tracemalloc, numa passada separada para não distorcer os tempos).
+
+Cenários por tamanho:
+    frio    caches e armazenamento local vazios (primeiro relatório do dia)
+    quente  catálogos em cache, relatório remontado
+    periodo relatório histórico dos últimos --period-days dias (com caches quentes)
+
+Uso:
+    python benchmark_nexti.py --sizes 1000,10000,100000 --latency-ms 30
+    python benchmark_nexti.py --json resultado.json
+    python benchmark_nexti.py --baseline resultado.json --tolerance 0.25   # sai com 1 se regrediu
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from nexti_mock import MockNextiServer, SyntheticTenant
+
+
+class StageTimer:
+    """Callback de progresso do relatório que anota início e fim de cada etapa."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.started, self.finished = {}, {}
+
+    def __call__(self, stage, status, detail=None, fraction=None):
+        now = time.perf_counter() - self.origin
+        if status == "running":
+            self.started.setdefault(stage, now)
+        elif status == "done":
+            self.started.setdefault(stage, now)
+            self.finished[stage] = now
+
+    def durations(self):
+        return {stage: round(self.finished[stage] - self.started[stage], 4) for stage in self.finished}
+
+
+def _configure_environment(mock_url, store_path):
+    # nexti_api lê a configuração na importação: o ambiente precisa estar pronto antes.
+    os.environ.update({
+        "NEXTI_API_URL": mock_url,
+        "NEXTI_CLIENT_ID": "benchmark",
+        "NEXTI_API_TOKEN": "benchmark",
+        "NEXTI_STORE_PATH": store_path,
+        "NEXTI_CACHE_DIR": "",
+    })
+
+
+def _reset(nexti_api, catalogs=True):
+    if catalogs:
+        nexti_api.reference_cache.invalidate()
+        nexti_api.override_cache.invalidate()
+    if nexti_api.nexti_store:
+        if catalogs:
+            nexti_api.nexti_store.invalidate_catalog()
+        nexti_api.nexti_store.invalidate_reports()
+    nexti_api._memory_reports.clear()
+
+
+def _wait_for_store(nexti_api):
+    # Espera as gravações em segundo plano para não disputarem CPU com a próxima medição.
+    if nexti_api.nexti_store:
+        nexti_api.nexti_store.submit("report_info", "").result()
+
+
+def _run_once(nexti_api, server, engine, period=None, trace_memory=False, verbose=False):
+    server.reset_stats()
+    timer = StageTimer()
+    if trace_memory:
+        tracemalloc.start()
+    # Os prints do nexti_api ficam de fora da saída, a menos que --verbose.
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        started = time.perf_counter()
+        rows = nexti_api._get_report(*(period or (None, None)), progress=timer, engine=engine)
+        elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    _wait_for_store(nexti_api)
+    stats = server.stats()
+    return {
+        "total_s": round(elapsed, 4),
+        "rows": len(rows),
+        "rows_per_s": round(len(rows) / elapsed) if elapsed else None,
+        "stages": timer.durations(),
+        "http_requests": sum(stats["requests"].values()),
+        "http_mb": round(stats["bytes"] / 1e6, 2),
+        "peak_mb": round(peak / 1e6, 1) if peak is not None else None,
+    }
+
+
+def _period(days):
+    finish = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(seconds=1)
+    start = (finish - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0)
+    return start.strftime("%d%m%Y%H%M%S"), finish.strftime("%d%m%Y%H%M%S")
+
+
+def run_benchmark(sizes, engine="python", latency_ms=0, jitter_ms=0, period_days=7, repeat=1, memory=True,
+                  verbose=False):
+    server = MockNextiServer(SyntheticTenant(1), latency_ms=latency_ms, jitter_ms=jitter_ms).start()
+    # Diretório privado (0700) para o armazenamento local, removido ao fim mesmo se a medição falhar.
+    store_dir = tempfile.TemporaryDirectory(prefix="nexti_bench_")
+    nexti_api = None
+    results = {}
+    try:
+        _configure_environment(server.url, os.path.join(store_dir.name, "nexti.sqlite3"))
+        import nexti_api
+
+        for size in sizes:
+            server.set_tenant(SyntheticTenant(size))
+            scenarios = {}
+
+            def best_of(reset_catalogs, period=None):
+                runs = []
+                for _ in range(repeat):
+                    _reset(nexti_api, catalogs=reset_catalogs)
+                    runs.append(_run_once(nexti_api, server, engine, period, verbose=verbose))
+                return min(runs, key=lambda run: run["total_s"])
+
+            scenarios["frio"] = best_of(reset_catalogs=True)
+            if memory:
+                _reset(nexti_api)
+                memory_run = _run_once(nexti_api, server, engine, trace_memory=True, verbose=verbose)
+                scenarios["frio"]["peak_mb"] = memory_run["peak_mb"]
+            scenarios["quente"] = best_of(reset_catalogs=False)
+            if period_days:
+                scenarios["periodo"] = best_of(reset_catalogs=False, period=_period(period_days))
+            results[str(size)] = scenarios
+            _print_size(size, scenarios)
+    finally:
+        server.stop()
+        if nexti_api is not None:
+            _wait_for_store(nexti_api)
+        store_dir.cleanup()
+    return results
+
+
+def _print_size(size, scenarios):
+    print(f"\n=== {size} colaboradores ===")
+    for name, result in scenarios.items():
+        memory = f", pico {result['peak_mb']} MB" if result.get("peak_mb") is not None else ""
+        print(f"  {name:8s} {result['total_s']:8.3f}s  {result['rows']} linhas  {result['rows_per_s']} linhas/s  "
+              f"{result['http_requests']} req / {result['http_mb']} MB{memory}")
+        stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in result["stages"].items())
+        print(f"           {stages}")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Lista as medições (tempo total e pico de memória) piores que a referência além da tolerância."""
+    regressions = []
+    for size, scenarios in results.items():
+        for name, result in scenarios.items():
+            reference = baseline.get(size, {}).get(name)
+            if not reference:
+                continue
+            for metric in ("total_s", "peak_mb"):
+                current, previous = result.get(metric), reference.get(metric)
+                if current is not None and previous and current > previous * (1 + tolerance):
+                    regressions.append(f"{size}/{name}/{metric}: {previous} -> {current}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do relatório da Nexti contra a Nexti simulada.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="tamanhos de tenant, separados por vírgula")
+    parser.add_argument("--engine", default="python", choices=("python", "pandas"))
+    parser.add_argument("--latency-ms", type=float, default=0, help="latência por requisição da Nexti simulada")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--period-days", type=int, default=7, help="dias do cenário histórico (0 desliga)")
+    parser.add_argument("--repeat", type=int, default=1, help="repetições por cenário (vale a melhor)")
+    parser.add_argument("--no-memory", action="store_true", help="não mede o pico de memória")
+    parser.add_argument("--verbose", action="store_true", help="mostra o log do nexti_api durante as medições")
+    parser.add_argument("--json", help="grava os resultados neste arquivo")
+    parser.add_argument("--baseline", help="resultados anteriores (--json) para detectar regressões")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="piora aceita em relação à referência")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = run_benchmark(sizes, engine=args.engine, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            period_days=args.period_days, repeat=args.repeat, memory=not args.no_memory,
+                            verbose=args.verbose)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            regressions = compare_with_baseline(results, json.load(fh), args.tolerance)
+        if regressions:
+            print("\n[REGRESSÃO] " + "\n[REGRESSÃO] ".join(regressions))
+            sys.exit(1)
+        print("\nSem regressões em relação à referência.")
+
+
+if __name__ == "__main__":
+    main()
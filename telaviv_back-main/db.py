@@ -1,65 +1,349 @@
 # db.py
 import os
-import mysql.connector.pooling
-from flask import current_app
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+import mysql.connector.errors
+from flask import current_app, g
+
+from metrics import counter, gauge, histogram
+
+# ------------------------------------------------------------
+# 1️⃣  Configuração do pool (variáveis de ambiente)
+# ------------------------------------------------------------
+#   DB_POOL_SIZE          conexões por worker (padrão: DB_MAX_CONNECTIONS / WEB_CONCURRENCY, ou 10)
+#   DB_MAX_CONNECTIONS    orçamento de conexões do servidor para a aplicação inteira (opcional)
+#   WEB_CONCURRENCY       número de workers do gunicorn (o mesmo que o gunicorn lê)
+#   DB_POOL_TIMEOUT       segundos esperando uma conexão livre antes de desistir (5)
+#   DB_POOL_MAX_LIFETIME  segundos até uma conexão ser reciclada (1800; 0 desliga)
+#   DB_POOL_PING_AFTER    conexão ociosa há mais que isso é testada com ping antes do uso (30; 0 = sempre)
+#   DB_POOL_WARMUP        conexões abertas em segundo plano na primeira utilização (2)
+#   DB_POOL_RESET_SESSION "1" (padrão) limpa a sessão ao devolver a conexão ao pool
+
+def _pool_size():
+    if os.getenv("DB_POOL_SIZE"):
+        return int(os.getenv("DB_POOL_SIZE"))
+    if os.getenv("DB_MAX_CONNECTIONS"):
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        return max(1, int(os.getenv("DB_MAX_CONNECTIONS")) // max(1, workers))
+    return 10   # 10 conexões por padrão
+
+# ------------------------------------------------------------
+# 2️⃣  Métricas do pool (expostas em /metrics)
+# ------------------------------------------------------------
+DB_POOL_SIZE = gauge("db_pool_size", "Conexões do pool MySQL neste worker")
+DB_POOL_CONNECTIONS = gauge("db_pool_connections", "Conexões abertas do pool, por estado", ("state",))
+DB_POOL_WAITING = gauge("db_pool_waiting", "Pedidos aguardando uma conexão livre")
+DB_POOL_CHECKOUT_SECONDS = histogram(
+    "db_pool_checkout_seconds",
+    "Tempo para obter uma conexão do pool",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_POOL_EXHAUSTED = counter("db_pool_exhausted_total", "Pedidos de conexão que esgotaram DB_POOL_TIMEOUT")
+DB_POOL_ERRORS = counter("db_pool_checkout_errors_total", "Falhas ao obter conexão (exceto pool esgotado)")
+DB_POOL_CREATED = counter("db_pool_connections_created_total", "Conexões MySQL abertas pelo pool")
+DB_POOL_DISCARDED = counter("db_pool_discarded_total", "Conexões descartadas: expired, ping ou reset",
+                            ("reason",))
+
+# ------------------------------------------------------------
+# 3️⃣  Pool de conexões
+# ------------------------------------------------------------
+class _Entry:
+    __slots__ = ("cnx", "created_at", "last_used")
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.created_at = self.last_used = time.monotonic()
+
+
+class PooledConnection:
+    """
+    Conexão emprestada do pool. Repassa tudo para a conexão do mysql-connector;
+    ``close()`` devolve a conexão ao pool em vez de encerrá-la (como antes).
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def _cnx(self):
+        entry = self.__dict__.get("_entry")
+        if entry is None:
+            raise mysql.connector.errors.OperationalError("Conexão já devolvida ao pool.")
+        return entry.cnx
+
+    def __getattr__(self, name):
+        return getattr(self._cnx(), name)
+
+    def __setattr__(self, name, value):
+        # conn.autocommit = False etc. vão para a conexão de verdade
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cnx(), name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Conexão esquecida sem close(): volta para o pool em vez de vazar a vaga.
+        if self.__dict__.get("_entry") is not None:
+            self.close()
+
+
+class ConnectionPool:
+    """
+    Pool de conexões MySQL com espera limitada.
+
+    - Sem conexão livre, o pedido espera até ``timeout`` segundos (em vez de falhar
+      na hora, como o MySQLConnectionPool); depois levanta PoolError.
+    - Conexões são abertas sob demanda até ``size`` (e ``warmup`` delas em segundo plano).
+    - Antes do uso, uma conexão ociosa há mais de ``ping_after`` segundos é testada com
+      ping; conexões mais velhas que ``max_lifetime`` são recicladas. Conexão morta
+      é trocada por uma nova sem o chamador perceber.
+    """
+
+    def __init__(self, size, timeout=5, max_lifetime=1800, ping_after=30, warmup=2, reset_session=True,
+                 **db_config):
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.reset_session = reset_session
+        self.db_config = db_config
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._open = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        DB_POOL_SIZE.set(size)
+        if warmup:
+            threading.Thread(target=self._warm_up, args=(min(warmup, size),), name="db-pool-warmup",
+                             daemon=True).start()
+
+    def get_connection(self):
+        entry = self._checkout()
+        try:
+            entry = self._validate(entry)
+        except Exception:
+            self._forget()
+            raise
+        return PooledConnection(self, entry)
+
+    # ---- internos -------------------------------------------
+    def _checkout(self):
+        """Conexão ociosa, ou ``None`` com uma vaga reservada para abrir uma nova."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()   # a mais recente: menos chance de estar morta
+                    self._publish()
+                    return entry
+                if self._open < self.size:
+                    self._open += 1
+                    self._publish()
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise mysql.connector.errors.PoolError(
+                        f"Nenhuma conexão livre em {self.timeout}s (pool com {self.size} conexões).")
+                self._waiting += 1
+                self._publish()
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    self._publish()
+
+    def _validate(self, entry):
+        if entry is None:
+            return self._connect()
+        now = time.monotonic()
+        if self.max_lifetime and now - entry.created_at > self.max_lifetime:
+            self._close_quietly(entry, "expired")
+            return self._connect()
+        if now - entry.last_used >= self.ping_after:
+            try:
+                entry.cnx.ping(reconnect=False)
+            except mysql.connector.Error:
+                self._close_quietly(entry, "ping")
+                return self._connect()
+        return entry
+
+    def _connect(self):
+        entry = _Entry(mysql.connector.connect(**self.db_config))
+        DB_POOL_CREATED.inc()
+        return entry
+
+    def _release(self, entry):
+        now = time.monotonic()
+        if self.max_lifetime and now - entry.created_at > self.max_lifetime:
+            self._close_quietly(entry, "expired")
+            self._forget()
+            return
+        try:
+            if self.reset_session:
+                entry.cnx.reset_session()
+            elif entry.cnx.in_transaction:
+                entry.cnx.rollback()
+        except mysql.connector.Error:
+            self._close_quietly(entry, "reset")
+            self._forget()
+            return
+        entry.last_used = now
+        with self._cond:
+            self._idle.append(entry)
+            self._publish()
+            self._cond.notify()
+
+    def _forget(self):
+        """Libera a vaga de uma conexão que não volta para o pool."""
+        with self._cond:
+            self._open -= 1
+            self._publish()
+            self._cond.notify()
+
+    def _close_quietly(self, entry, reason):
+        DB_POOL_DISCARDED.labels(reason).inc()
+        try:
+            entry.cnx.close()
+        except Exception:
+            pass
+
+    def _warm_up(self, count):
+        for _ in range(count):
+            with self._cond:
+                if self._open >= count:
+                    return  # os pedidos já abriram conexões suficientes
+                self._open += 1
+            try:
+                entry = self._connect()
+            except mysql.connector.Error as err:
+                print(f"[DB] Falha ao pré-abrir conexão: {err}")
+                self._forget()
+                return
+            with self._cond:
+                self._idle.append(entry)
+                self._publish()
+                self._cond.notify()
+
+    def _publish(self):
+        # Chamado com self._cond adquirido
+        DB_POOL_CONNECTIONS.labels("idle").set(len(self._idle))
+        DB_POOL_CONNECTIONS.labels("in_use").set(self._open - len(self._idle))
+        DB_POOL_WAITING.set(self._waiting)
+
 
 # ------------------------------------------------------------
-# 1️⃣  Pool de conexões – singleton
+# 4️⃣  Pool de conexões – singleton por processo
 # ------------------------------------------------------------
 _pool = None
+_pool_lock = threading.Lock()
 
 def _init_pool():
     """
     Cria o pool usando as variáveis de ambiente que já estão
     disponíveis no systemd (ou no .env quando rodar localmente).
     É chamado automaticamente na primeira chamada a get_db_connection().
+    Depois de um fork (gunicorn com --preload) cada worker cria o seu.
     """
     global _pool
-    if _pool is not None:
-        return  # já inicializado
-
-    db_config = {
-        "user":     os.getenv("DB_USER"),
-        "password": os.getenv("DB_PASSWORD"),
-        "host":     os.getenv("DB_HOST"),
-        "port":     int(os.getenv("DB_PORT", "3306")),   # fallback para 3306
-        "database": os.getenv("DB_NAME"),
-        "charset":  "utf8mb4",
-        # Opcional: ajuste de tempo limite de conexão
-        "connection_timeout": 10,
-        # CORREÇÃO: Força o pool a verificar e resetar conexões perdidas
-        "pool_reset_session": True,
-    }
-
-    # tamanho do pool – ajuste conforme carga esperada
-    POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))   # 10 conexões por padrão
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            return  # já inicializado
 
-    try:
-        _pool = mysql.connector.pooling.MySQLConnectionPool(
-            pool_name="app_pool",
-            pool_size=POOL_SIZE,
+        db_config = {
+            "user":     os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASSWORD"),
+            "host":     os.getenv("DB_HOST"),
+            "port":     int(os.getenv("DB_PORT", "3306")),   # fallback para 3306
+            "database": os.getenv("DB_NAME"),
+            "charset":  "utf8mb4",
+            # Opcional: ajuste de tempo limite de conexão
+            "connection_timeout": 10,
+        }
+
+        # tamanho do pool – ajuste conforme carga esperada
+        POOL_SIZE = _pool_size()
+
+        _pool = ConnectionPool(
+            POOL_SIZE,
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+            max_lifetime=int(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+            ping_after=int(os.getenv("DB_POOL_PING_AFTER", "30")),
+            warmup=int(os.getenv("DB_POOL_WARMUP", "2")),
+            reset_session=os.getenv("DB_POOL_RESET_SESSION", "1") != "0",
             **db_config,
         )
         # Log simples (você pode trocar por logging)
-        print(f"[DB] Pool criado com {POOL_SIZE} conexões.")
-    except mysql.connector.Error as err:
-        print(f"[DB] Falha ao criar pool: {err}")
-        raise
+        print(f"[DB] Pool criado com até {POOL_SIZE} conexões (pid {_pool.pid}).")
 
 def get_db_connection():
     """
     Retorna uma conexão já pronta do pool.
+    Sem conexão livre, espera até DB_POOL_TIMEOUT segundos antes de levantar PoolError.
     O chamador deve fechar a conexão (conn.close()) quando terminar;
     isso devolve a conexão ao pool, não a encerra.
     """
-    if _pool is None:
+    if _pool is None or _pool.pid != os.getpid():
         _init_pool()
 
+    started = time.perf_counter()
     try:
         conn = _pool.get_connection()
         # opcional: garantir autocommit = False (para controle manual)
         conn.autocommit = False
         return conn
+    except mysql.connector.errors.PoolError as err:
+        DB_POOL_EXHAUSTED.inc()
+        print(f"[DB] Pool esgotado: {err}")
+        raise
     except mysql.connector.Error as err:
+        DB_POOL_ERRORS.inc()
         print(f"[DB] Erro ao obter conexão do pool: {err}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+# ------------------------------------------------------------
+# 5️⃣  Conexão por requisição
+# ------------------------------------------------------------
+def get_request_connection():
+    """
+    Conexão da requisição atual. A primeira chamada pega uma conexão do pool;
+    as seguintes (decoradores, rota, funções auxiliares) reutilizam a mesma.
+    Não feche: ela volta ao pool no fim da requisição (close_request_connection).
+    """
+    if "db_conn" not in g:
+        g.db_conn = get_db_connection()
+    return g.db_conn
+
+@contextmanager
+def request_cursor(dictionary=True):
+    """Cursor sobre a conexão da requisição, fechado ao sair do bloco ``with``."""
+    cursor = get_request_connection().cursor(dictionary=dictionary)
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+def close_request_connection(exc=None):
+    """
+    Devolve ao pool a conexão da requisição (registrado com app.teardown_appcontext).
+    O que não foi confirmado com commit() é desfeito na devolução.
+    """
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
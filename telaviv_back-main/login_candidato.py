@@ -12,7 +12,7 @@ from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import create_access_token
 from werkzeug.security import check_password_hash
 
-from db import get_db_connection
+from db import request_cursor
 
 # ---------------------------------------------------------------------------
 # BLUEPRINT
@@ -79,10 +79,6 @@ def login():
     start_time = time.monotonic()
     logging.info("Login request received")
 
-    # Garantimos que as variáveis existam no escopo da função
-    conn = None
-    cursor = None
-
     try:
         payload = request.get_json(silent=True) or {}
         email = payload.get("email")
@@ -131,11 +127,8 @@ def login():
             logging.debug("reCAPTCHA ignorado (modo teste)")
 
         # ----------------------------------------------------
-        # 3️⃣ Busca do usuário (pool de conexões)
+        # 3️⃣ Busca do usuário (conexão da requisição, do pool)
         # ----------------------------------------------------
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
         sql = """
             SELECT u.id,
                    u.username,
@@ -147,8 +140,9 @@ def login():
             JOIN perfil_users p ON u.type = p.id
             WHERE u.email = %s
         """
-        cursor.execute(sql, (email,))
-        user = cursor.fetchone()
+        with request_cursor() as cursor:
+            cursor.execute(sql, (email,))
+            user = cursor.fetchone()
 
         if not user:
             # Não revelamos se o e‑mail existe
@@ -227,14 +221,7 @@ def login():
 
     finally:
         # ----------------------------------------------------
-        # 8️⃣ Liberação de recursos (garantido mesmo em early returns)
+        # 8️⃣ Tempo total (a conexão volta ao pool no fim da requisição)
         # ----------------------------------------------------
-        try:
-            if cursor:
-                cursor.close()
-        finally:
-            if conn:
-                conn.close()          # devolve ao pool
-
         elapsed_ms = (time.monotonic() - start_time) * 1000
         logging.debug(f"Tempo total de login: {elapsed_ms:.1f} ms")
\ No newline at end of file
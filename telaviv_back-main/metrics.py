@@ -0,0 +1,364 @@
+"""
+Métricas da aplicação no formato texto do Prometheus (GET /metrics).
+
+Contadores, medidores e histogramas simples, thread-safe, mantidos em memória
+pelo processo. Com vários workers do gunicorn cada um mantém os próprios
+números; o pid do worker que respondeu aparece em
+``process_start_time_seconds{worker=...}``.
+
+Uso:
+    from metrics import counter, histogram
+    REQUESTS = counter("nexti_http_requests_total", "Chamadas à API da Nexti", ("endpoint", "status"))
+    REQUESTS.labels("persons", "200").inc()
+
+Etapas do relatório: ``StageTimings`` é um callback de progresso (mesma
+assinatura do usado pelos jobs) que mede cada etapa entre "running" e "done",
+alimenta um histograma e monta o cabeçalho ``Server-Timing`` da resposta.
+
+Requisições: ``request_metrics.init_app(app)`` mede a duração de cada rota
+(por método, regra da rota e status) e conta as requisições em andamento.
+
+Configuração (variáveis de ambiente):
+    METRICS_TOKEN   obrigatório: /metrics exige 'Authorization: Bearer <token>'; sem ele o
+                    endpoint fica desligado (403), para não expor rotas e volumes por padrão
+"""
+import hmac
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from flask import Blueprint, Response, g, request
+
+load_dotenv()
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Limites padrão dos histogramas de duração (segundos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+WORKER_LABEL = str(os.getpid())
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """Base das métricas: uma série por combinação de valores dos rótulos."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._series[()] = self._new_series()
+
+    def labels(self, *values):
+        """Série dos rótulos ``values`` (na ordem de ``labelnames``), criada no primeiro uso."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera os rótulos {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def collect(self):
+        """Linhas do formato texto do Prometheus para esta métrica."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, item in series:
+            lines.extend(item.sample_lines(self.name, self.labelnames, values))
+        return lines
+
+    # Métricas sem rótulos: atalhos direto na métrica
+    def __getattr__(self, attr):
+        if attr in ("inc", "dec", "set", "observe", "time", "track") and not self.labelnames:
+            return getattr(self._series[()], attr)
+        raise AttributeError(attr)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def sample_lines(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class _GaugeValue(_Value):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    @contextmanager
+    def track(self):
+        """Soma 1 enquanto o bloco executa (ex.: requisições em andamento)."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        """Observa a duração do bloco, em segundos."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def sample_lines(self, name, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(labelnames, values, [("le", _format_value(bound))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, values, [("le", "+Inf")])
+        lines.append(f"{name}_bucket{labels} {count}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {count}")
+        return lines
+
+
+class Counter(_Metric):
+    """Valor que só cresce (requisições, bytes, linhas...)."""
+
+    kind = "counter"
+
+    def _new_series(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    """Valor que sobe e desce (requisições em andamento, conexões ocupadas...)."""
+
+    kind = "gauge"
+
+    def _new_series(self):
+        return _GaugeValue()
+
+
+class Histogram(_Metric):
+    """Distribuição de valores (durações) em faixas cumulativas, mais soma e contagem."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_series(self):
+        return _HistogramValue(self.buckets)
+
+
+class Registry:
+    """Conjunto de métricas expostas juntas em /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Reimportar um módulo (ex.: recarga em desenvolvimento) devolve a métrica já registrada.
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+PROCESS_START_TIME = gauge("process_start_time_seconds", "Início do processo (epoch, segundos)", ("worker",))
+PROCESS_START_TIME.labels(WORKER_LABEL).set(time.time())
+
+
+class StageTimings:
+    """
+    Callback de progresso que mede a duração de cada etapa ("running" → "done").
+
+    Repassa as chamadas para ``progress`` (se houver) e, com ``histogram``, observa
+    cada duração com o rótulo da etapa. Etapas concluídas sem terem começado
+    (ex.: relatório lido do armazenamento local) não são medidas.
+    """
+
+    def __init__(self, histogram=None, progress=None):
+        self.histogram = histogram
+        self.progress = progress
+        self.durations = {}
+        self._created = time.perf_counter()
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, status, detail=None, fraction=None):
+        if status == "running":
+            with self._lock:
+                self._started.setdefault(stage, time.perf_counter())
+        elif status == "done":
+            with self._lock:
+                started = self._started.pop(stage, None)
+            if started is not None:
+                self.record(stage, time.perf_counter() - started)
+        if self.progress is not None:
+            self.progress(stage, status, detail, fraction)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+        if self.histogram is not None:
+            self.histogram.labels(stage).observe(seconds)
+
+    @contextmanager
+    def measure(self, stage):
+        """Mede um bloco de código como a etapa ``stage`` (ex.: serialização da resposta)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def server_timing(self):
+        """
+        Valor do cabeçalho Server-Timing (durações em milissegundos), mais 'total' desde a
+        criação. Etapas paralelas (os catálogos) se sobrepõem: a soma passa do total.
+        """
+        with self._lock:
+            durations = [*self.durations.items(), ("total", time.perf_counter() - self._created)]
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations)
+
+    def apply(self, response):
+        """Anexa o Server-Timing à resposta."""
+        response.headers["Server-Timing"] = self.server_timing()
+        return response
+
+
+HTTP_REQUEST_SECONDS = histogram("http_request_duration_seconds", "Duração das requisições por rota",
+                                 ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = gauge("http_requests_in_flight", "Requisições em andamento neste worker")
+
+
+class RequestMetrics:
+    """
+    Extensão Flask: ``request_metrics.init_app(app)`` registra os hooks que medem cada requisição.
+
+    A rota entra no rótulo pela regra ('/api/nexti/jobs/<job_id>'), não pela URL, para que
+    ids não criem séries novas. Respostas com ``stream_with_context`` são medidas até o
+    último bloco ser enviado (o contexto da requisição só termina ali).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+    def _after_request(self, response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc=None):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        status = g.pop("_metrics_status", 500)
+        route = request.url_rule.rule if request.url_rule is not None else "<sem rota>"
+        HTTP_REQUEST_SECONDS.labels(request.method, route, status).observe(time.perf_counter() - started)
+
+
+request_metrics = RequestMetrics()
+
+
+# --- ENDPOINT ---
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    expected = os.getenv('METRICS_TOKEN')
+    if not expected:
+        return Response("metrics disabled: set METRICS_TOKEN\n", status=403, mimetype='text/plain')
+    received = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(received.encode('utf-8'), expected.encode('utf-8')):
+        return Response("unauthorized\n", status=401, mimetype='text/plain')
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
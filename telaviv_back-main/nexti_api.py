@@ -1,221 +1,1192 @@
 import os
 import requests
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response, current_app, stream_with_context
 from flask_jwt_extended import jwt_required
 from datetime import datetime, timezone, time, timedelta
 from dotenv import load_dotenv
 from requests.exceptions import HTTPError
 import hashlib
+import csv
+import io
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from zoneinfo import ZoneInfo
+from nexti_cache import ReferenceCache, reference_cache, override_cache
+from nexti_client import nexti_client, nexti_token_manager
+from nexti_store import (nexti_store, REPORT_FILTERS, REPORT_SORT_KEYS, report_column_value, report_row_digest,
+                         report_search_text)
+from nexti_jobs import report_jobs
+from nexti_models import EMPTY, project, project_catalog
+from metrics import StageTimings, counter, histogram
 
 
 load_dotenv()
 nexti_bp = Blueprint('nexti_api', __name__, url_prefix='/api/nexti')
-NEXTI_API_URL, NEXTI_CLIENT_ID, NEXTI_API_TOKEN = os.getenv('NEXTI_API_URL'), os.getenv('NEXTI_CLIENT_ID'), os.getenv('NEXTI_API_TOKEN')
+
+# Catálogos de referência baixados via '/<recurso>/all' e mantidos no cache compartilhado
+REFERENCE_RESOURCES = ("persons", "workplaces", "companies", "clients", "careers", "schedules")
+
+# Limite de requisições simultâneas à Nexti (somando todos os catálogos e páginas)
+NEXTI_FETCH_CONCURRENCY = int(os.getenv('NEXTI_FETCH_CONCURRENCY', '6'))
+_http_slots = threading.BoundedSemaphore(NEXTI_FETCH_CONCURRENCY)
+# Dois executores separados: as tarefas de catálogo esperam pelas de busca (páginas), então
+# elas não podem disputar os mesmos threads (evita deadlock).
+_catalog_executor = ThreadPoolExecutor(max_workers=len(REFERENCE_RESOURCES), thread_name_prefix='nexti-catalog')
+_fetch_executor = ThreadPoolExecutor(max_workers=NEXTI_FETCH_CONCURRENCY, thread_name_prefix='nexti-fetch')
+# Histórico de transferências (postos e turnos) num executor próprio: não entra na fila dos
+# catálogos e da busca de detalhes das outras requisições.
+_overrides_executor = ThreadPoolExecutor(max_workers=NEXTI_FETCH_CONCURRENCY, thread_name_prefix='nexti-overrides')
+_catalog_locks = {resource: threading.Lock() for resource in REFERENCE_RESOURCES}
+
+# Catálogos mantidos por sincronização incremental (só o que mudou desde a última sincronização).
+# Uma carga completa ainda é feita a cada NEXTI_FULL_SYNC_INTERVAL segundos.
+INCREMENTAL_RESOURCES = {
+    "persons": "/persons/lastupdate/start/{start}/finish/{finish}",
+    "workplaces": "/workplaces/lastupdate/start/{start}/finish/{finish}",
+}
+NEXTI_INCREMENTAL_SYNC = os.getenv('NEXTI_INCREMENTAL_SYNC', '1') != '0'
+NEXTI_FULL_SYNC_INTERVAL = int(os.getenv('NEXTI_FULL_SYNC_INTERVAL', '21600'))
+NEXTI_SYNC_OVERLAP = timedelta(seconds=int(os.getenv('NEXTI_SYNC_OVERLAP', '600')))
+NEXTI_TIMEZONE = ZoneInfo(os.getenv('NEXTI_TIMEZONE', 'America/Sao_Paulo'))
+API_DATE_FORMAT = "%d%m%Y%H%M%S"
+
+# Etapas do relatório publicadas como progresso pelos jobs em segundo plano
+REPORT_STAGES = ("token", *REFERENCE_RESOURCES, "overrides", "details", "build", "etag")
+PROGRESS_EVERY_ROWS = 1000
+
+# Métricas do relatório (expostas em /metrics; a duração das etapas também vai no cabeçalho Server-Timing)
+REPORT_STAGE_SECONDS = histogram("nexti_report_stage_seconds", "Duração de cada etapa do relatório da Nexti",
+                                 ("stage",))
+REPORTS_SERVED = counter("nexti_reports_total",
+                         "Relatórios entregues: store (armazenamento local), memory, built ou stream",
+                         ("source",))
+REPORT_ROWS = counter("nexti_report_rows_built_total", "Linhas do relatório montadas", ("engine",))
+
+# Colunas da planilha exportada: (cabeçalho, chave do registro, largura) — as mesmas da tela do painel
+EXPORT_COLUMNS = (
+    ("Hora", "Hora", 20), ("Empresa", "Razao Social Empresa", 35), ("Cliente", "Cliente", 35),
+    ("Negócio", "Unidade de Negocio", 25), ("Posto", "Nome Posto de Trabalho", 35),
+    ("Colaborador", "Nome Colaborador", 35), ("Matrícula", "Matricula", 15), ("CPF", "CPF", 20),
+    ("Cargo", "Descricao Cargo", 25), ("Cronograma", "Cronograma", 20), ("Horário", "Horario", 20),
+    ("Turno", "Turno", 25),
+)
+EXPORT_FILENAME = "Relatorio_Colaboradores_Nexti"
+
+# Registros enviados por bloco nas respostas em streaming
+STREAM_CHUNK_SIZE = int(os.getenv('NEXTI_STREAM_CHUNK_SIZE', '500'))
+
+# Relatórios já montados ficam no armazenamento local por este tempo (segundos)
+NEXTI_REPORT_TTL = int(os.getenv('NEXTI_REPORT_TTL', os.getenv('NEXTI_CACHE_TTL', '300')))
+# Sem o armazenamento local, os últimos relatórios montados ficam na memória do worker (LRU por período)
+NEXTI_REPORT_MEMORY_KEYS = int(os.getenv('NEXTI_REPORT_MEMORY_KEYS', '4'))
+
+# Versões do relatório atual guardadas para o feed incremental do Google Sheets (?since=<etag>).
+# Sem o armazenamento local elas ficam na memória de cada worker: um 'since' que outro worker
+# gerou não é encontrado e o feed devolve o relatório inteiro ('full': true).
+NEXTI_SYNC_VERSIONS = int(os.getenv('NEXTI_SYNC_VERSIONS', '20'))
+# etag → {ID Colaborador: hash da linha}, da mais antiga para a mais recente (só sem armazenamento local)
+_report_versions = OrderedDict()
+_report_versions_lock = threading.Lock()
+# report_key → IndexedReport, do menos para o mais recente (só sem armazenamento local)
+_memory_reports = OrderedDict()
+_memory_reports_lock = threading.Lock()
+
+# Paginação do relatório filtrado no servidor (?page=&page_size=)
+NEXTI_REPORT_PAGE_SIZE = int(os.getenv('NEXTI_REPORT_PAGE_SIZE', '100'))
+NEXTI_REPORT_MAX_PAGE_SIZE = int(os.getenv('NEXTI_REPORT_MAX_PAGE_SIZE', '1000'))
+REPORT_QUERY_PARAMS = (*REPORT_FILTERS, "q", "sort", "page", "page_size")
+
+# Motor de montagem do relatório: 'python' (linha a linha) ou 'pandas' (vetorizado, nexti_frames.py)
+REPORT_ENGINES = ("python", "pandas")
+NEXTI_REPORT_ENGINE = os.getenv('NEXTI_REPORT_ENGINE', 'python')
+# Com o motor pandas, roda também o montador linha a linha e registra as divergências
+NEXTI_REPORT_ENGINE_VERIFY = os.getenv('NEXTI_REPORT_ENGINE_VERIFY', '0') == '1'
+
+# Detalhes sem endpoint '/all' confiável: resolvidos por id, em lote, antes de montar o relatório
+DETAIL_RESOURCES = {"situations": "/personSituations", "business_units": "/businessUnits"}
 
 # --- FUNÇÕES AUXILIARES ---
+def _no_progress(stage, status, detail=None, fraction=None):
+    """Callback de progresso padrão (requisições síncronas não acompanham etapas)."""
+
 def get_nexti_access_token():
-    auth_url = f"{NEXTI_API_URL}/security/oauth/token"
-    params = {'grant_type': 'client_credentials', 'client_id': NEXTI_CLIENT_ID, 'client_secret': NEXTI_API_TOKEN}
-    auth = (NEXTI_CLIENT_ID, NEXTI_API_TOKEN)
-    try:
-        response = requests.post(auth_url, params=params, auth=auth, timeout=20)
-        response.raise_for_status()
-        return response.json().get('access_token')
-    except requests.exceptions.RequestException as e:
-        print(f"[ERRO DE CONEXÃO] Falha ao obter token da Nexti: {e}")
-        return None
+    # O token fica em cache até pouco antes de vencer e é renovado em segundo plano.
+    return nexti_token_manager.get_token()
 
-def _populate_cache_from_all_endpoint(resource_name, headers):
-    print(f"  > Populando cache para '{resource_name}'...")
-    all_items, current_page, page_size = [], 0, 10000
-    while True:
-        url = f"{NEXTI_API_URL}/{resource_name}/all?page={current_page}&size={page_size}&sort=id,asc"
-        try:
-            response = requests.get(url, headers=headers, timeout=90)
-            response.raise_for_status()
-            response_data = response.json()
+def _nexti_get(path, headers, timeout):
+    """
+    GET na Nexti respeitando NEXTI_FETCH_CONCURRENCY. Com 401 (token revogado ou trocado
+    antes do 'expires_in'), renova o token e tenta mais uma vez. ``headers`` é o mesmo dict
+    para todo o relatório: as chamadas seguintes já saem com o token novo.
+    """
+    with _http_slots:
+        response = nexti_client.get(path, headers=headers, timeout=timeout)
+    if response.status_code != 401:
+        return response
+    rejected = headers.get('Authorization', '').removeprefix('Bearer ')
+    token = nexti_token_manager.renew(rejected)
+    if not token:
+        return response
+    headers['Authorization'] = f'Bearer {token}'
+    with _http_slots:
+        return nexti_client.get(path, headers=headers, timeout=timeout)
+
+def _fetch_page(url, headers, timeout=90):
+    response = _nexti_get(url, headers, timeout)
+    response.raise_for_status()
+    return response.json()
+
+def _iter_pages(base_url, headers, page_size=10000, timeout=90, ordered=True):
+    """
+    Gera o 'content' de cada página de um endpoint paginado da Nexti.
+    A primeira página revela 'totalPages'; as demais são buscadas em paralelo e entregues
+    na ordem das páginas (``ordered=True``) ou assim que cada uma chega (``ordered=False``).
+    """
+    separator = '&' if '?' in base_url else '?'
+    page_url = lambda page: f"{base_url}{separator}page={page}&size={page_size}&sort=id,asc"
+
+    first = _fetch_page(page_url(0), headers, timeout)
+    first_content = first.get('content', [])
+    yield first_content
+    if not first_content or first.get('last', True):
+        return
+
+    total_pages = first.get('totalPages')
+    if total_pages is None:
+        # Sem 'totalPages' não dá para paralelizar: segue página a página.
+        current_page = 1
+        while True:
+            response_data = _fetch_page(page_url(current_page), headers, timeout)
             page_content = response_data.get('content', [])
             if not page_content: break
-            all_items.extend(page_content)
+            yield page_content
             if response_data.get('last', True): break
             current_page += 1
-        except requests.exceptions.RequestException as e:
-            print(f"  [AVISO] Falha ao buscar '{resource_name}'. Erro: {e}.")
-            break
-    cache_dict = {item['id']: item for item in all_items}
+        return
+
+    futures = [_fetch_executor.submit(_fetch_page, page_url(page), headers, timeout) for page in range(1, total_pages)]
+    for future in (futures if ordered else as_completed(futures)):
+        yield future.result().get('content', [])
+
+def _fetch_all_pages(base_url, headers, page_size=10000, timeout=90):
+    """Lista com o 'content' de todas as páginas, na ordem (ver ``_iter_pages``)."""
+    return list(_iter_pages(base_url, headers, page_size, timeout))
+
+def _populate_cache_from_all_endpoint(resource_name, headers, raise_on_error=False):
+    print(f"  > Populando cache para '{resource_name}'...")
+    cache_dict = {}
+    try:
+        for page_content in _fetch_all_pages(f"/{resource_name}/all", headers):
+            # Só os campos usados pelo relatório são mantidos (nexti_models.py).
+            cache_dict.update((item['id'], project(resource_name, item)) for item in page_content)
+    except requests.exceptions.RequestException as e:
+        if raise_on_error: raise
+        print(f"  [AVISO] Falha ao buscar '{resource_name}'. Erro: {e}.")
     print(f"  > Cache para '{resource_name}' populado com {len(cache_dict)} itens.")
     return cache_dict
 
-def _get_api_details(url, cache, item_id, headers):
-    if item_id and item_id not in cache:
+def _restore_catalog_from_store(resource_name):
+    """
+    Worker recém-iniciado: carrega no cache o último snapshot salvo localmente,
+    com a idade que ele realmente tem (pode já nascer vencido e seguir para a sincronização).
+    """
+    catalog, sync_state = nexti_store.load_catalog(resource_name)
+    if catalog is None:
+        return
+    catalog = project_catalog(resource_name, catalog)
+    age = (datetime.now(NEXTI_TIMEZONE) - sync_state["synced_at"]).total_seconds()
+    ttl = reference_cache.ttl_for(resource_name)
+    reference_cache.set(resource_name, catalog, ttl=max(0, ttl - age) if ttl is not None else None)
+    reference_cache.set(f"{resource_name}.sync", sync_state, ttl=None)
+    print(f"  > Snapshot local de '{resource_name}' carregado ({len(catalog)} itens).")
+
+def _delta_sync_catalog(resource_name, headers):
+    """
+    Atualiza o último snapshot do catálogo aplicando apenas os registros alterados
+    desde a sincronização anterior (endpoints 'lastupdate' da Nexti).
+    Retorna None quando é preciso uma carga completa (sem snapshot, snapshot antigo
+    demais ou falha na consulta incremental).
+    """
+    snapshot = reference_cache.get(resource_name, allow_stale=True)
+    sync_state = reference_cache.get(f"{resource_name}.sync")
+    if snapshot is None or not sync_state:
+        return None
+    now = datetime.now(NEXTI_TIMEZONE)
+    if (now - sync_state["full_sync_at"]).total_seconds() > NEXTI_FULL_SYNC_INTERVAL:
+        return None
+
+    # A janela volta um pouco além da última sincronização para não perder alterações na fronteira.
+    start = (sync_state["synced_at"] - NEXTI_SYNC_OVERLAP).strftime(API_DATE_FORMAT)
+    path = INCREMENTAL_RESOURCES[resource_name].format(start=start, finish=now.strftime(API_DATE_FORMAT))
+    try:
+        pages = _fetch_all_pages(path, headers)
+    except requests.exceptions.RequestException as e:
+        print(f"  [AVISO] Falha na sincronização incremental de '{resource_name}'. Erro: {e}.")
+        return None
+
+    changed = {item['id']: project(resource_name, item) for page_content in pages for item in page_content}
+    # Cópia nova em vez de alterar o snapshot: outras requisições podem estar iterando sobre ele.
+    catalog = {**snapshot, **changed} if changed else snapshot
+    new_sync_state = {**sync_state, "synced_at": now}
+    reference_cache.set(f"{resource_name}.sync", new_sync_state, ttl=None)
+    if nexti_store:
+        nexti_store.submit("save_catalog", resource_name, changed, new_sync_state, replace=False)
+    print(f"  > Sincronização incremental de '{resource_name}': {len(changed)} itens alterados.")
+    return catalog
+
+def _load_catalog(resource_name, headers):
+    """
+    Devolve o catálogo do cache compartilhado; se expirado, baixa de novo.
+    Um download com falha não é guardado: usa-se a última cópia (mesmo vencida), se houver.
+    Sem cópia nenhuma o erro é propagado: com um catálogo vazio o relatório sairia vazio
+    (ou sem postos, empresas...) e seria salvo e versionado como se fosse o estado real.
+    """
+    cached = reference_cache.get(resource_name)
+    if cached is not None:
+        print(f"  > Cache para '{resource_name}' reaproveitado ({len(cached)} itens).")
+        return cached
+    # Requisições simultâneas com o cache vencido esperam um único download.
+    with _catalog_locks[resource_name]:
+        if nexti_store and reference_cache.get(resource_name, allow_stale=True) is None:
+            _restore_catalog_from_store(resource_name)
+        cached = reference_cache.get(resource_name)
+        if cached is not None:
+            return cached
+        incremental = NEXTI_INCREMENTAL_SYNC and resource_name in INCREMENTAL_RESOURCES
+        if incremental:
+            catalog = _delta_sync_catalog(resource_name, headers)
+            if catalog is not None:
+                reference_cache.set(resource_name, catalog)
+                return catalog
+        sync_started_at = datetime.now(NEXTI_TIMEZONE)
         try:
-            res = requests.get(f"{url}/{item_id}", headers=headers, timeout=10)
-            cache[item_id] = res.json().get('value', {}) if res.ok else {}
+            catalog = _populate_cache_from_all_endpoint(resource_name, headers, raise_on_error=True)
         except requests.exceptions.RequestException as e:
-            cache[item_id] = {}
-    return cache.get(item_id, {})
+            print(f"  [AVISO] Falha ao buscar '{resource_name}'. Erro: {e}.")
+            stale = reference_cache.get(resource_name, allow_stale=True)
+            if stale is not None:
+                print(f"  > Usando cópia anterior de '{resource_name}' ({len(stale)} itens).")
+                return stale
+            raise
+        sync_state = {"synced_at": sync_started_at, "full_sync_at": sync_started_at}
+        reference_cache.set(resource_name, catalog)
+        if incremental:
+            reference_cache.set(f"{resource_name}.sync", sync_state, ttl=None)
+        if nexti_store:
+            nexti_store.submit("save_catalog", resource_name, catalog, sync_state)
+        return catalog
+
+def _load_reference_caches(headers, progress=_no_progress):
+    # Os seis catálogos são baixados em paralelo: o custo passa a ser o do mais lento.
+    futures = {_catalog_executor.submit(_load_catalog, resource, headers): resource for resource in REFERENCE_RESOURCES}
+    for resource in REFERENCE_RESOURCES:
+        progress(resource, "running")
+    caches = {}
+    for future in as_completed(futures):
+        resource = futures[future]
+        caches[resource] = future.result()
+        progress(resource, "done", f"{len(caches[resource])} itens")
+    caches.update({"situations": {}, "business_units": {}})
+    caches["schedule_parts"] = _parse_schedules(caches["schedules"])
+    return caches
+
+def _fetch_detail(path, item_id, headers):
+    res = _nexti_get(f"{path}/{item_id}", headers, timeout=10)
+    if res.status_code == 404:
+        return {}  # id inexistente na Nexti: o vazio pode ficar em cache
+    # Demais erros (5xx depois das novas tentativas, 401...) vão para 'failed' e não entram no cache.
+    res.raise_for_status()
+    return res.json().get('value', {})
+
+def _prefetch_details(cache_key, item_ids, headers):
+    """
+    Resolve de uma vez todos os ids distintos de 'personSituations' ou 'businessUnits'.
+    Os já conhecidos vêm do cache compartilhado; os que faltam são buscados em paralelo
+    (limitados por NEXTI_FETCH_CONCURRENCY). Falhas viram {} só nesta execução.
+    """
+    known = reference_cache.get(cache_key) or {}
+    missing = {item_id for item_id in item_ids if item_id and item_id not in known}
+    if not missing:
+        return known
+    print(f"  > Buscando {len(missing)} itens de '{cache_key}'...")
+    path = DETAIL_RESOURCES[cache_key]
+    futures = {item_id: _fetch_executor.submit(_fetch_detail, path, item_id, headers) for item_id in missing}
+    resolved, failed = dict(known), []
+    for item_id, future in futures.items():
+        try:
+            resolved[item_id] = project(cache_key, future.result())
+        except requests.exceptions.RequestException:
+            failed.append(item_id)
+    reference_cache.set(cache_key, resolved)
+    if failed:
+        print(f"  [AVISO] Falha ao buscar {len(failed)} itens de '{cache_key}'.")
+        resolved = {**resolved, **{item_id: EMPTY[cache_key] for item_id in failed}}
+    return resolved
+
+def _prefetch_record_details(active_persons, caches, overrides, headers):
+    """Preenche caches['situations'] e caches['business_units'] para todos os colaboradores do relatório."""
+    workplace_overrides = overrides.get("workplaces", {})
+    no_workplace = EMPTY["workplaces"]
+    situation_ids = {p.personSituationId for p in active_persons}
+    business_unit_ids = {
+        caches["workplaces"].get(workplace_overrides.get(p.id, p.workplaceId), no_workplace).businessUnitId
+        for p in active_persons
+    }
+    futures = {
+        "situations": _catalog_executor.submit(_prefetch_details, "situations", situation_ids, headers),
+        "business_units": _catalog_executor.submit(_prefetch_details, "business_units", business_unit_ids, headers),
+    }
+    caches.update({cache_key: future.result() for cache_key, future in futures.items()})
 
 # --- FUNÇÃO PARA BUSCAR DADOS HISTÓRICOS E CRIAR MAPAS DE SOBRESCRITA ---
+def _reduce_latest_transfers(page_content, latest, value_field):
+    """
+    Incorpora uma página de transferências em ``latest`` (personId → (ordem, valor)),
+    mantendo só a mais recente de cada colaborador. A ordem é (transferDateTime, id):
+    a data mais recente vence e, no empate, a transferência de id maior.
+    Uma passada por página, sem acumular nem reordenar o histórico inteiro.
+    """
+    for transfer in page_content:
+        person_id = transfer.get('personId')
+        if person_id is None or value_field not in transfer:
+            continue
+        rank = (transfer.get('transferDateTime') or '', transfer.get('id') or 0)
+        current = latest.get(person_id)
+        if current is None or rank >= current[0]:
+            latest[person_id] = (rank, transfer[value_field])
+
+def _transfer_day(transfer, first_day, last_day):
+    """Dia da transferência (pelo transferDateTime), limitado ao intervalo consultado."""
+    try:
+        day = datetime.strptime((transfer.get('transferDateTime') or '')[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return last_day
+    return min(max(day, first_day), last_day)
+
+def _fetch_latest_transfers(resource_name, value_field, run, headers):
+    """
+    Busca os dias de ``run`` numa única consulta e reduz as transferências por dia.
+    Retorna ``(latest_by_day, completo)``; ``completo`` é False se alguma página falhou.
+    """
+    # As páginas são reduzidas na ordem em que chegam: a redução não depende da ordem.
+    first_day, last_day = run[0][0], run[-1][0]
+    latest_by_day = {day: {} for day, _, _, _ in run}
+    url = f"/{resource_name}/lastupdate/nextiuser/start/{run[0][1]}/finish/{run[-1][2]}"
+    try:
+        for page_content in _iter_pages(url, headers, ordered=False):
+            by_day = defaultdict(list)
+            for transfer in page_content:
+                by_day[_transfer_day(transfer, first_day, last_day)].append(transfer)
+            for day, transfers in by_day.items():
+                _reduce_latest_transfers(transfers, latest_by_day[day], value_field)
+    except requests.exceptions.RequestException as e:
+        print(f"  [AVISO] Falha ao buscar '{resource_name}'. Erro: {e}.")
+        return latest_by_day, False
+    return latest_by_day, True
+
+def _split_period_by_day(start_date_str, finish_date_str):
+    """
+    Quebra o período em fatias de um dia: ``[(dia, início, fim, dia_inteiro)]``.
+    Só as fatias que cobrem o dia inteiro (00:00:00 a 23:59:59) entram no cache.
+    """
+    start = datetime.strptime(start_date_str, API_DATE_FORMAT)
+    finish = datetime.strptime(finish_date_str, API_DATE_FORMAT)
+    slices = []
+    day = start.date()
+    while day <= finish.date():
+        day_start, day_end = datetime.combine(day, time.min), datetime.combine(day, time(23, 59, 59))
+        slice_start, slice_end = max(start, day_start), min(finish, day_end)
+        full_day = slice_start == day_start and slice_end == day_end
+        slices.append((day, slice_start.strftime(API_DATE_FORMAT), slice_end.strftime(API_DATE_FORMAT), full_day))
+        day += timedelta(days=1)
+    return slices
+
+def _slice_cache_key(resource_name, day):
+    return f"{resource_name}.{day.strftime('%Y%m%d')}"
+
+def _cached_transfer_slice(resource_name, slice_):
+    """Fatia de um dia já em cache, ou ``None``. Só dias inteiros entram no cache."""
+    day, _, _, full_day = slice_
+    return override_cache.get(_slice_cache_key(resource_name, day)) if full_day else None
+
+def _load_transfer_run(resource_name, value_field, run, headers):
+    """
+    Busca uma sequência de dias sem cache numa única consulta à Nexti (páginas em paralelo)
+    e guarda cada dia inteiro na sua própria chave, para que outros períodos que cubram só
+    parte da sequência também sejam montados do cache.
+    """
+    latest_by_day, complete = _fetch_latest_transfers(resource_name, value_field, run, headers)
+    if complete:
+        today = datetime.now(NEXTI_TIMEZONE).date()
+        for day, _, _, full_day in run:
+            if not full_day:
+                continue
+            # Dias já encerrados não mudam mais: ficam em cache sem expiração. O dia corrente
+            # (ou futuro) ainda recebe transferências, então vale só pelo TTL curto.
+            if day < today:
+                override_cache.set(_slice_cache_key(resource_name, day), latest_by_day[day], ttl=None)
+            else:
+                override_cache.set(_slice_cache_key(resource_name, day), latest_by_day[day])
+    return _merge_latest(latest_by_day.values())
+
+def _submit_transfer_slices(resource_name, value_field, slices, headers):
+    """
+    Dias em cache entram direto; cada sequência contígua de dias sem cache vira uma única
+    consulta, em segundo plano. Devolve Futures.
+    """
+    futures, run = [], []
+
+    def flush():
+        if run:
+            futures.append(_overrides_executor.submit(_load_transfer_run, resource_name, value_field,
+                                                      list(run), headers))
+            run.clear()
+
+    for slice_ in slices:
+        cached = _cached_transfer_slice(resource_name, slice_)
+        if cached is None:
+            run.append(slice_)
+            continue
+        flush()
+        futures.append(_completed(cached))
+    flush()
+    return futures
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def _merge_latest(partials):
+    """Junta reduções parciais mantendo, por colaborador, a transferência mais recente."""
+    latest = {}
+    for partial in partials:
+        for person_id, (rank, value) in partial.items():
+            current = latest.get(person_id)
+            if current is None or rank >= current[0]:
+                latest[person_id] = (rank, value)
+    return latest
+
 def _get_historical_overrides(start_date_str, finish_date_str, headers):
-    historical_overrides = {
-        "workplaces": {},
-        "schedules": {}
-    }
-    
+    # O período é montado a partir das fatias em cache; os dias que faltam são buscados na Nexti
+    # (uma consulta por sequência contígua), postos e turnos ao mesmo tempo, páginas em paralelo.
+    print("  > Buscando histórico de postos de trabalho e de turnos...")
+    slices = _split_period_by_day(start_date_str, finish_date_str)
     # 1. Busca transferências de posto
-    print("  > Buscando histórico de postos de trabalho...")
-    transfers_in_period, current_page, page_size = [], 0, 10000
-    while True:
-        url = f"{NEXTI_API_URL}/workplacetransfers/lastupdate/nextiuser/start/{start_date_str}/finish/{finish_date_str}?page={current_page}&size={page_size}&sort=id,asc"
-        try:
-            response = requests.get(url, headers=headers, timeout=90)
-            response.raise_for_status()
-            response_data = response.json()
-            page_content = response_data.get('content', [])
-            if not page_content: break
-            transfers_in_period.extend(page_content)
-            # Ordena por data da transferência para garantir que a mais recente sobrescreva as mais antigas
-            transfers_in_period.sort(key=lambda x: x.get('transferDateTime', ''))
-            for transfer in transfers_in_period:
-                historical_overrides["workplaces"][transfer['personId']] = transfer['workplaceId']
-            if response_data.get('last', True): break
-            current_page += 1
-        except requests.exceptions.RequestException as e:
-            print(f"  [AVISO] Falha ao buscar 'workplaceTransfers'. Erro: {e}.")
-            break
-    print(f"  > Histórico de postos encontrado para {len(historical_overrides['workplaces'])} colaboradores.")
-
+    workplace_futures = _submit_transfer_slices("workplacetransfers", "workplaceId", slices, headers)
     # 2. Busca transferências de turno
-    print("  > Buscando histórico de turnos...")
-    current_page = 0
-    while True:
-        url = f"{NEXTI_API_URL}/scheduletransfers/lastupdate/nextiuser/start/{start_date_str}/finish/{finish_date_str}?page={current_page}&size={page_size}&sort=id,asc"
-        try:
-            response = requests.get(url, headers=headers, timeout=90)
-            response.raise_for_status()
-            response_data = response.json()
-            page_content = response_data.get('content', [])
-            if not page_content: break
-            for transfer in page_content:
-                if 'personId' in transfer and 'rotationCode' in transfer:
-                    historical_overrides["schedules"][transfer['personId']] = transfer['rotationCode']
-            if response_data.get('last', True): break
-            current_page += 1
-        except requests.exceptions.RequestException as e:
-            print(f"  [AVISO] Falha ao buscar 'scheduleTransfers'. Erro: {e}.")
-            break
-    print(f"  > Histórico de turnos encontrado para {len(historical_overrides['schedules'])} colaboradores.")
-    
-    return historical_overrides
+    schedule_futures = _submit_transfer_slices("scheduletransfers", "rotationCode", slices, headers)
+    latest_workplaces = _merge_latest(future.result() for future in workplace_futures)
+    latest_schedules = _merge_latest(future.result() for future in schedule_futures)
+    print(f"  > Histórico de postos encontrado para {len(latest_workplaces)} colaboradores.")
+    print(f"  > Histórico de turnos encontrado para {len(latest_schedules)} colaboradores.")
 
-# --- FUNÇÃO CENTRAL PARA MONTAR O REGISTRO DE UM COLABORADOR ---
-def _build_complete_record(person_details, caches, headers, overrides):
-    person_id = person_details.get('id')
-    
-    # Verifica se há uma sobrescrita histórica; senão, usa o dado atual.
-    workplace_id_to_use = overrides.get("workplaces", {}).get(person_id, person_details.get('workplaceId'))
-    rotation_code_to_use = overrides.get("schedules", {}).get(person_id, person_details.get('rotationCode'))
-
-    workplace_details = caches["workplaces"].get(workplace_id_to_use, {})
-    client_details = caches["clients"].get(workplace_details.get('clientId'), {})
-    company_details = caches["companies"].get(person_details.get('companyId'), {})
-    career_details = caches["careers"].get(person_details.get('careerId'), {})
-    schedule_details = caches["schedules"].get(person_details.get('scheduleId'), {})
-    situation_details = _get_api_details(f"{NEXTI_API_URL}/personSituations", caches["situations"], person_details.get('personSituationId'), headers)
-    business_unit_details = _get_api_details(f"{NEXTI_API_URL}/businessUnits", caches["business_units"], workplace_details.get('businessUnitId'), headers)
-
-    schedule_description = schedule_details.get('name', '')
+    return {
+        "workplaces": {person_id: value for person_id, (_, value) in latest_workplaces.items()},
+        "schedules": {person_id: value for person_id, (_, value) in latest_schedules.items()},
+    }
+
+# --- ESCALAS: DESCRIÇÃO DECOMPOSTA UMA VEZ POR ESCALA ---
+_NO_SCHEDULE = ("", "N/A", "")
+# (catálogo de origem, scheduleId → (cronograma, horario, turno_base)); refeito só quando o catálogo muda.
+_parsed_schedules = (None, {})
+_parsed_schedules_lock = threading.Lock()
+
+def _parse_schedule_name(schedule_description):
     cronograma, horario, turno_base = schedule_description, "N/A", ""
     if schedule_description and ',' in schedule_description:
         parts = [p.strip() for p in schedule_description.split(',')]
         cronograma, horario = parts[0], parts[1]
         if len(parts) > 2: turno_base = parts[2]
+    return cronograma, horario, turno_base
+
+def _parse_schedules(schedules):
+    """
+    Decompõe o 'name' de cada escala em (cronograma, horario, turno_base). São poucas
+    centenas de escalas para milhares de colaboradores: o resultado é reaproveitado
+    enquanto o catálogo em cache for o mesmo objeto.
+    """
+    global _parsed_schedules
+    with _parsed_schedules_lock:
+        source, parsed = _parsed_schedules
+        if source is not schedules:
+            parsed = {schedule_id: _parse_schedule_name(schedule.name)
+                      for schedule_id, schedule in schedules.items()}
+            _parsed_schedules = (schedules, parsed)
+        return parsed
+
+# --- FUNÇÃO CENTRAL PARA MONTAR O REGISTRO DE UM COLABORADOR ---
+def _build_complete_record(person_details, caches, overrides):
+    person_id = person_details.id
+    
+    # Verifica se há uma sobrescrita histórica; senão, usa o dado atual.
+    workplace_id_to_use = overrides.get("workplaces", {}).get(person_id, person_details.workplaceId)
+    rotation_code_to_use = overrides.get("schedules", {}).get(person_id, person_details.rotationCode)
+
+    workplace_details = caches["workplaces"].get(workplace_id_to_use, EMPTY["workplaces"])
+    client_details = caches["clients"].get(workplace_details.clientId, EMPTY["clients"])
+    company_details = caches["companies"].get(person_details.companyId, EMPTY["companies"])
+    career_details = caches["careers"].get(person_details.careerId, EMPTY["careers"])
+    situation_details = caches["situations"].get(person_details.personSituationId, EMPTY["situations"])
+    business_unit_details = caches["business_units"].get(workplace_details.businessUnitId, EMPTY["business_units"])
+
+    cronograma, horario, turno_base = caches["schedule_parts"].get(person_details.scheduleId, _NO_SCHEDULE)
 
     turno_final = turno_base
     if rotation_code_to_use is not None:
         turno_final = f"{turno_base} - T:{rotation_code_to_use}" if turno_base else f"T:{rotation_code_to_use}"
     if not turno_final: turno_final = "N/A"
     
-    workplace_name = workplace_details.get('name')
+    workplace_name = workplace_details.name
     formatted_workplace_name = f"Posto - {workplace_name}" if workplace_name else None
 
     return {
-        "Matricula": person_details.get('enrolment'), "Nome Colaborador": person_details.get('name'),
-        "CPF": person_details.get('cpf'), "Data Admissao": person_details.get('admissionDate'),
-        "Data Demissao": person_details.get('demissionDate'), "Nome Posto de Trabalho": formatted_workplace_name,
-        "Razao Social Empresa": company_details.get('companyName'), "Cliente": client_details.get('name'),
-        "Unidade de Negocio": business_unit_details.get('name'), "Descricao Cargo": career_details.get('name'),
-        "Descricao Situacao": situation_details.get('description'), "Cronograma": cronograma,
+        "Matricula": person_details.enrolment, "Nome Colaborador": person_details.name,
+        "CPF": person_details.cpf, "Data Admissao": person_details.admissionDate,
+        "Data Demissao": person_details.demissionDate, "Nome Posto de Trabalho": formatted_workplace_name,
+        "Razao Social Empresa": company_details.companyName, "Cliente": client_details.name,
+        "Unidade de Negocio": business_unit_details.name, "Descricao Cargo": career_details.name,
+        "Descricao Situacao": situation_details.description, "Cronograma": cronograma,
         "Horario": horario, "Turno": turno_final, "ID Colaborador": person_id,
     }
 
+# --- MONTAGEM DO RELATÓRIO (COMPARTILHADA PELAS ROTAS) ---
+def _parse_report_period(data):
+    """Converte 'start'/'finish' (ddmmaaaa...) do corpo da requisição para o formato da API, ou (None, None)."""
+    start_date_from_req, finish_date_from_req = data.get('start'), data.get('finish')
+    if not (start_date_from_req and finish_date_from_req):
+        return None, None
+    start_dt_obj = datetime.strptime(start_date_from_req[:8], "%d%m%Y")
+    finish_dt_obj = datetime.strptime(finish_date_from_req[:8], "%d%m%Y")
+    start_dt_adjusted = datetime.combine(start_dt_obj.date(), time.min)
+    finish_dt_adjusted = datetime.combine(finish_dt_obj.date(), time.max)
+    return start_dt_adjusted.strftime(API_DATE_FORMAT), finish_dt_adjusted.strftime(API_DATE_FORMAT)
+
+def _report_key(start_date_str, finish_date_str):
+    return f"{start_date_str}-{finish_date_str}" if start_date_str else "atual"
+
+def _iter_report_records(caches, historical_overrides, headers, progress=_no_progress, engine="python"):
+    """
+    Prepara o relatório (busca em lote de situações e unidades de negócio) e devolve um
+    gerador que monta os registros um a um, já na ordem final.
+    A preparação é feita antes do primeiro registro para que erros ainda virem um HTTP 500.
+    """
+    # 3. Monta o relatório final sempre com base na lista geral de ativos
+    active_persons = [p for p in caches["persons"].values() if p.personSituationId in [1, 2]]
+    print(f"[INFO] Montando relatório final com base em {len(active_persons)} colaboradores ativos.")
+    progress("details", "running", f"{len(active_persons)} colaboradores ativos")
+    _prefetch_record_details(active_persons, caches, historical_overrides, headers)
+    progress("details", "done", "situações e unidades de negócio resolvidas")
+
+    # 5. Coloca os colaboradores com dados históricos no topo (mantendo a ordem original dentro de cada grupo)
+    overridden_person_ids = set(historical_overrides.get("workplaces", {}).keys()) | set(historical_overrides.get("schedules", {}).keys())
+    if overridden_person_ids:
+        print(f"  > Reordenando relatório para priorizar {len(overridden_person_ids)} colaboradores com dados históricos.")
+        active_persons = [p for p in active_persons if p.id in overridden_person_ids] + \
+                         [p for p in active_persons if p.id not in overridden_person_ids]
+
+    if engine == "pandas":
+        return _build_records_with_pandas(active_persons, caches, historical_overrides, progress)
+
+    def generate():
+        total = len(active_persons)
+        progress("build", "running", f"montando {total} linhas")
+        for index, person_details in enumerate(active_persons, 1):
+            # 4. Para cada pessoa, constrói o registro aplicando as sobrescritas históricas (se existirem)
+            yield _build_complete_record(person_details, caches, historical_overrides)
+            if index % PROGRESS_EVERY_ROWS == 0:
+                progress("build", "running", fraction=index / total)
+        REPORT_ROWS.labels("python").inc(total)
+        progress("build", "done", f"{total} linhas")
+    return generate()
+
+def _build_records_with_pandas(active_persons, caches, historical_overrides, progress=_no_progress):
+    # Import local: o pandas só é carregado quando esse motor é usado.
+    import nexti_frames
+
+    progress("build", "running", f"montando {len(active_persons)} linhas (pandas)")
+    records = nexti_frames.build_report_records(active_persons, caches, historical_overrides)
+    if NEXTI_REPORT_ENGINE_VERIFY:
+        expected = [_build_complete_record(p, caches, historical_overrides) for p in active_persons]
+        mismatches = nexti_frames.find_mismatches(expected, records)
+        if mismatches:
+            print(f"  [AVISO] Motor pandas divergiu do montador linha a linha: {mismatches}")
+        else:
+            print(f"  > Motor pandas conferido: {len(records)} linhas idênticas.")
+    REPORT_ROWS.labels("pandas").inc(len(records))
+    progress("build", "done", f"{len(records)} linhas")
+    return iter(records)
+
+def _requested_engine(data=None):
+    """Motor pedido via ?engine= ou corpo; senão o de NEXTI_REPORT_ENGINE."""
+    engine = request.args.get('engine') or (data or {}).get('engine') or NEXTI_REPORT_ENGINE
+    if engine not in REPORT_ENGINES:
+        raise ValueError(f"Motor de relatório desconhecido: {engine}")
+    return engine
+
+def _report_etag(row_digests):
+    """Hash do conteúdo do relatório, a partir dos hashes das linhas: muda se, e só se, alguma linha mudar."""
+    digest = hashlib.sha1()
+    for row_digest in row_digests:
+        digest.update(row_digest.encode('ascii'))
+    return digest.hexdigest()
+
+def _get_report(start_date_str=None, finish_date_str=None, stream=False, progress=_no_progress, engine=None,
+                with_etag=False):
+    """
+    Devolve as linhas do relatório. Um relatório montado há menos de NEXTI_REPORT_TTL
+    segundos é lido do armazenamento local (ou, sem ele, da memória do worker); senão é
+    montado agora e salvo em segundo plano.
+    Com ``stream=True`` devolve um gerador (e não guarda o relatório, para manter a memória constante).
+    Com ``with_etag=True`` devolve ``(linhas, etag)``; o etag é None quando não é conhecido
+    (relatório montado em streaming).
+    A duração de cada etapa vai para o histograma nexti_report_stage_seconds.
+    """
+    progress = StageTimings(REPORT_STAGE_SECONDS, progress)
+    report_key = _report_key(start_date_str, finish_date_str)
+    # Só o relatório atual (o do Google Sheets) guarda histórico de versões para o feed incremental.
+    keep_versions = NEXTI_SYNC_VERSIONS if report_key == _report_key(None, None) else 0
+    if nexti_store:
+        # O etag é lido antes das linhas: se o relatório for trocado no meio, o conteúdo
+        # enviado é mais novo que o etag (nunca o contrário), e o próximo pedido recebe tudo.
+        stored_info = nexti_store.report_info(report_key, max_age=NEXTI_REPORT_TTL)
+        stored_rows = (nexti_store.iter_report if stream else nexti_store.load_report)(report_key, max_age=NEXTI_REPORT_TTL)
+        if stored_rows is not None:
+            _report_served(report_key, "store", "armazenamento local", progress)
+            if with_etag:
+                return stored_rows, stored_info["etag"] if stored_info else None
+            return stored_rows
+    else:
+        memory_report = _memory_report(report_key)
+        if memory_report is not None:
+            _report_served(report_key, "memory", "memória", progress)
+            if not with_etag:
+                return memory_report.rows
+            if keep_versions > 0:
+                # Pode ter sido montado sem etag (consulta paginada): a versão entra no histórico agora.
+                _remember_report_version(memory_report.etag, memory_report.rows, memory_report.row_digests,
+                                         keep_versions)
+            return memory_report.rows, memory_report.etag
+
+    progress("token", "running")
+    access_token_nexti = get_nexti_access_token()
+    if not access_token_nexti: raise Exception("Falha na autenticação com a API da Nexti.")
+    headers = {'Authorization': f'Bearer {access_token_nexti}'}
+    progress("token", "done")
+
+    # 1. Pré-carrega todos os dados de referência essenciais (reaproveitando o cache compartilhado)
+    caches = _load_reference_caches(headers, progress)
+
+    historical_overrides = {}
+    if start_date_str and finish_date_str:
+        # 2. Se houver data, busca os dados históricos para sobrescrever
+        print("[INFO] Datas fornecidas. Buscando dados históricos para mesclagem...")
+        progress("overrides", "running")
+        historical_overrides = _get_historical_overrides(start_date_str, finish_date_str, headers)
+        progress("overrides", "done", f"{len(historical_overrides['workplaces'])} postos e {len(historical_overrides['schedules'])} turnos históricos")
+    else:
+        print("[INFO] Nenhuma data fornecida. Gerando relatório de estado atual.")
+        progress("overrides", "done", "relatório de estado atual")
+
+    records = _iter_report_records(caches, historical_overrides, headers, progress, engine or NEXTI_REPORT_ENGINE)
+    if stream:
+        REPORTS_SERVED.labels("stream").inc()
+        return (records, None) if with_etag else records
+    database_completa = list(records)
+    etag = row_digests = None
+    if with_etag or nexti_store:
+        # Os hashes das linhas servem ao etag e ao histórico de versões: calculados uma vez só.
+        progress("etag", "running")
+        row_digests = [report_row_digest(row) for row in database_completa]
+        etag = _report_etag(row_digests)
+        progress("etag", "done")
+    else:
+        progress("etag", "done", "não solicitado")
+    REPORTS_SERVED.labels("built").inc()
+    if nexti_store:
+        nexti_store.submit("save_report", report_key, database_completa, etag=etag, keep_versions=keep_versions,
+                           row_digests=row_digests)
+    else:
+        _remember_report(report_key, database_completa, etag, row_digests)
+        if etag and keep_versions > 0:
+            _remember_report_version(etag, database_completa, row_digests, keep_versions)
+    return (database_completa, etag) if with_etag else database_completa
+
+def _report_served(report_key, source, description, progress):
+    """Relatório reaproveitado (``source``: 'store' ou 'memory'): todas as etapas constam como concluídas."""
+    print(f"[INFO] Relatório '{report_key}' reaproveitado ({description}).")
+    for stage in REPORT_STAGES:
+        progress(stage, "done", description if stage == "build" else None)
+    REPORTS_SERVED.labels(source).inc()
+
+# --- REQUISIÇÕES CONDICIONAIS (ETag / If-None-Match) ---
+def _stored_report_etag(report_key):
+    """Etag do relatório salvo e ainda válido, sem remontá-lo (None se não houver)."""
+    if not nexti_store:
+        memory_report = _memory_report(report_key)
+        return memory_report.etag if memory_report else None
+    info = nexti_store.report_info(report_key, max_age=NEXTI_REPORT_TTL)
+    return info["etag"] if info else None
+
+def _with_etag(response, etag):
+    if etag:
+        response.set_etag(etag)
+        # Dados autenticados: só o próprio cliente guarda, e sempre revalida.
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _not_modified(etag):
+    return _with_etag(Response(status=304), etag)
+
+def _remember_report_version(etag, rows, row_digests, keep_versions):
+    """Versão do relatório atual no histórico em memória (usado quando não há armazenamento local)."""
+    with _report_versions_lock:
+        if etag in _report_versions:
+            _report_versions.move_to_end(etag)
+            return
+    row_hashes = {row.get("ID Colaborador"): row_digest for row, row_digest in zip(rows, row_digests)
+                  if row.get("ID Colaborador") is not None}
+    with _report_versions_lock:
+        _report_versions[etag] = row_hashes
+        _report_versions.move_to_end(etag)
+        while len(_report_versions) > keep_versions:
+            _report_versions.popitem(last=False)
+
+def _version_row_hashes(etag):
+    """``ID Colaborador → hash da linha`` de uma versão do relatório atual, ou ``None`` se ela não existir (mais)."""
+    if nexti_store:
+        return nexti_store.version_row_hashes(_report_key(None, None), etag)
+    with _report_versions_lock:
+        return _report_versions.get(etag)
+
+def _report_diff(since, rows, etag):
+    """
+    Linhas adicionadas, alteradas e removidas (por 'ID Colaborador') entre a versão ``since``
+    e o relatório atual. Se a versão não estiver mais no histórico, devolve o relatório inteiro
+    ('full': true) e o cliente substitui a planilha.
+    """
+    if since and since == etag:
+        return {"version": etag, "since": since, "full": False, "added": [], "changed": [], "removed": []}
+    previous = _version_row_hashes(since) if since else None
+    if previous is None:
+        return {"version": etag, "since": since, "full": True, "rows": rows}
+    # Os hashes da versão atual já foram gravados no histórico quando o relatório foi montado;
+    # só são recalculados se a gravação ainda não terminou.
+    current = _version_row_hashes(etag) or {}
+    added, changed, current_ids = [], [], set()
+    for row in rows:
+        person_id = row.get("ID Colaborador")
+        current_ids.add(person_id)
+        previous_hash = previous.get(person_id)
+        if previous_hash is None:
+            added.append(row)
+        elif previous_hash != (current.get(person_id) or report_row_digest(row)):
+            changed.append(row)
+    removed = [person_id for person_id in previous if person_id not in current_ids]
+    return {"version": etag, "since": since, "full": False, "added": added, "changed": changed, "removed": removed}
+
+def _report_response(start_date_str, finish_date_str, stream_format=None, engine=None):
+    """
+    Relatório completo com ETag. Um 'If-None-Match' igual ao etag atual recebe 304 sem
+    corpo; se o relatório salvo ainda vale, nem chega a ser lido.
+    A duração das etapas vai no cabeçalho Server-Timing.
+    """
+    etag = _stored_report_etag(_report_key(start_date_str, finish_date_str))
+    if etag and request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
+    timings = StageTimings()
+    if stream_format:
+        records, etag = _get_report(start_date_str, finish_date_str, stream=True, progress=timings, engine=engine,
+                                    with_etag=True)
+        return timings.apply(_with_etag(_stream_response(records, stream_format), etag))
+    rows, etag = _get_report(start_date_str, finish_date_str, progress=timings, engine=engine, with_etag=True)
+    if etag and request.if_none_match.contains_weak(etag):
+        return timings.apply(_not_modified(etag))
+    with timings.measure("serialize"):
+        response = jsonify(rows)
+    return timings.apply(_with_etag(response, etag))
+
+# --- FILTROS, ORDENAÇÃO E PAGINAÇÃO NO SERVIDOR ---
+def _requested_report_query(data=None):
+    """
+    Lê os parâmetros de consulta (?client=&business_unit=&workplace=&situation=&career=,
+    ?q= busca em nome/CPF/matrícula, ?sort=name ou -name, ?page=&page_size=), da URL ou do corpo.
+    Filtros repetidos (?client=A&client=B) aceitam qualquer um dos valores.
+    Devolve None quando nenhum foi informado (relatório completo, como antes).
+    """
+    data = data or {}
+    if not any(name in request.args or name in data for name in REPORT_QUERY_PARAMS):
+        return None
+
+    filters = {}
+    for name in REPORT_FILTERS:
+        values = request.args.getlist(name) or data.get(name) or []
+        values = [values] if isinstance(values, str) else values
+        if values:
+            filters[name] = [str(value) for value in values]
+    sort = request.args.get('sort') or data.get('sort') or None
+    descending = bool(sort) and sort.startswith('-')
+    sort = sort.lstrip('-') if sort else None
+    if sort and sort not in REPORT_SORT_KEYS:
+        raise ValueError(f"Ordenação desconhecida: {sort} (use {', '.join(REPORT_SORT_KEYS)})")
+    try:
+        page = int(request.args.get('page') or data.get('page') or 1)
+        page_size = int(request.args.get('page_size') or data.get('page_size') or NEXTI_REPORT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError("'page' e 'page_size' devem ser números inteiros.")
+    if page < 1 or not 1 <= page_size <= NEXTI_REPORT_MAX_PAGE_SIZE:
+        raise ValueError(f"'page' deve ser >= 1 e 'page_size' entre 1 e {NEXTI_REPORT_MAX_PAGE_SIZE}.")
+    return {
+        "filters": filters, "search": (request.args.get('q') or data.get('q') or "").strip() or None,
+        "sort": sort, "descending": descending, "page": page, "page_size": page_size,
+    }
+
+class IndexedReport:
+    """
+    Relatório montado, com um índice por filtro (valor → posições das linhas) e o texto da
+    busca livre de cada linha. Atende a mesma consulta de NextiStore.query_report quando não
+    há armazenamento local, sem varrer o relatório inteiro a cada página.
+    """
+
+    def __init__(self, rows, etag=None, row_digests=None):
+        self.rows = rows
+        self.row_digests = row_digests
+        self._etag = etag
+        self.built_at = datetime.now(NEXTI_TIMEZONE)
+        self._indexes = {column: defaultdict(list) for column in REPORT_FILTERS}
+        for position, row in enumerate(rows):
+            for column, index in self._indexes.items():
+                index[report_column_value(row, column)].append(position)
+        self._search_texts = [report_search_text(row) for row in rows]
+
+    @property
+    def etag(self):
+        # Montado sem etag (nenhum pedido precisou dele): calculado na primeira requisição condicional.
+        if self._etag is None:
+            self.row_digests = [report_row_digest(row) for row in self.rows]
+            self._etag = _report_etag(self.row_digests)
+        return self._etag
+
+    def query(self, filters=None, search=None, sort=None, descending=False, offset=0, limit=None):
+        """Devolve ``(total, linhas)``, como NextiStore.query_report."""
+        positions = None
+        for column, values in (filters or {}).items():
+            index = self._indexes[column]
+            matched = {position for value in values for position in index.get(value, ())}
+            positions = matched if positions is None else positions & matched
+        positions = range(len(self.rows)) if positions is None else sorted(positions)
+        if search:
+            needle = search.casefold()
+            positions = [position for position in positions if needle in self._search_texts[position]]
+        rows = [self.rows[position] for position in positions]
+        if sort:
+            present = [row for row in rows if report_column_value(row, sort) is not None]
+            missing = [row for row in rows if report_column_value(row, sort) is None]
+            present.sort(key=lambda row: report_column_value(row, sort).lower(), reverse=descending)
+            rows = present + missing
+        return len(rows), rows[offset:None if limit is None else offset + limit]
+
+def _remember_report(report_key, rows, etag, row_digests):
+    """Guarda o relatório montado (já indexado) na memória do worker por NEXTI_REPORT_TTL segundos."""
+    report = IndexedReport(rows, etag, row_digests)
+    with _memory_reports_lock:
+        _memory_reports[report_key] = report
+        _memory_reports.move_to_end(report_key)
+        while len(_memory_reports) > NEXTI_REPORT_MEMORY_KEYS:
+            _memory_reports.popitem(last=False)
+
+def _memory_report(report_key):
+    """Relatório guardado em memória e ainda válido, ou ``None``."""
+    with _memory_reports_lock:
+        report = _memory_reports.get(report_key)
+        if report is None:
+            return None
+        if (datetime.now(NEXTI_TIMEZONE) - report.built_at).total_seconds() > NEXTI_REPORT_TTL:
+            del _memory_reports[report_key]
+            return None
+        _memory_reports.move_to_end(report_key)
+        return report
+
+def _query_report(start_date_str, finish_date_str, query, engine=None, progress=_no_progress):
+    """Uma página do relatório filtrado: do armazenamento local ou, sem ele, da memória (índices nos dois)."""
+    offset, limit = (query["page"] - 1) * query["page_size"], query["page_size"]
+    params = {key: query[key] for key in ("filters", "search", "sort", "descending")}
+    report_key = _report_key(start_date_str, finish_date_str)
+    result = None
+    if nexti_store:
+        result = nexti_store.query_report(report_key, offset=offset, limit=limit, max_age=NEXTI_REPORT_TTL, **params)
+    if result is None:
+        report = None if nexti_store else _memory_report(report_key)
+        if report is None:
+            rows = _get_report(start_date_str, finish_date_str, progress=progress, engine=engine)
+            # Sem armazenamento local o relatório recém-montado já ficou indexado na memória; com ele,
+            # a gravação ainda está na fila e esta página é montada dos índices de uma cópia local.
+            report = (None if nexti_store else _memory_report(report_key)) or IndexedReport(rows)
+        result = report.query(offset=offset, limit=limit, **params)
+    total, rows = result
+    return {"total": total, "page": query["page"], "page_size": query["page_size"], "rows": rows}
+
+def _requested_stream_format(data=None):
+    """'ndjson', 'json' (array JSON enviado em blocos) ou None, via ?stream=, corpo ou cabeçalho Accept."""
+    stream_format = request.args.get('stream') or (data or {}).get('stream')
+    if not stream_format and 'application/x-ndjson' in request.headers.get('Accept', ''):
+        stream_format = 'ndjson'
+    if stream_format in (True, 'true', '1'):
+        stream_format = 'json'
+    return stream_format if stream_format in ('ndjson', 'json') else None
+
+def _stream_response(records, stream_format):
+    """Resposta HTTP em blocos: o primeiro byte sai antes de o relatório inteiro ser montado."""
+    dumps = current_app.json.dumps  # mesmas opções do jsonify
+
+    def generate_ndjson():
+        chunk = []
+        for record in records:
+            chunk.append(dumps(record))
+            if len(chunk) >= STREAM_CHUNK_SIZE:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    def generate_json_array():
+        yield "["
+        chunk, first = [], True
+        for record in records:
+            chunk.append(dumps(record))
+            if len(chunk) >= STREAM_CHUNK_SIZE:
+                yield ("" if first else ",") + ",".join(chunk)
+                chunk, first = [], False
+        if chunk:
+            yield ("" if first else ",") + ",".join(chunk)
+        yield "]"
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json_array()), mimetype='application/json')
+
 # --- ENDPOINT PRINCIPAL COM A LÓGICA DE MESCLAGEM E REORDENAÇÃO ---
 @nexti_bp.route('/colaboradores_data', methods=['POST'])
 @jwt_required()
 def get_colaboradores_data():
     try:
-        access_token_nexti = get_nexti_access_token()
-        if not access_token_nexti: raise Exception("Falha na autenticação com a API da Nexti.")
-        headers = {'Authorization': f'Bearer {access_token_nexti}'}
-
-        # 1. Pré-carrega todos os dados de referência essenciais
-        caches = {
-            "persons": _populate_cache_from_all_endpoint("persons", headers),
-            "workplaces": _populate_cache_from_all_endpoint("workplaces", headers),
-            "companies": _populate_cache_from_all_endpoint("companies", headers),
-            "clients": _populate_cache_from_all_endpoint("clients", headers),
-            "careers": _populate_cache_from_all_endpoint("careers", headers),
-            "schedules": _populate_cache_from_all_endpoint("schedules", headers),
-            "situations": {}, "business_units": {}
-        }
-        
         data = request.get_json() or {}
-        start_date_from_req, finish_date_from_req = data.get('start'), data.get('finish')
-        
-        historical_overrides = {}
-        if start_date_from_req and finish_date_from_req:
-            # 2. Se houver data, busca os dados históricos para sobrescrever
-            print("[INFO] Datas fornecidas. Buscando dados históricos para mesclagem...")
-            API_DATE_FORMAT = "%d%m%Y%H%M%S"
-            start_dt_obj = datetime.strptime(start_date_from_req[:8], "%d%m%Y")
-            finish_dt_obj = datetime.strptime(finish_date_from_req[:8], "%d%m%Y")
-            start_dt_adjusted = datetime.combine(start_dt_obj.date(), time.min)
-            finish_dt_adjusted = datetime.combine(finish_dt_obj.date(), time.max)
-            start_date_str = start_dt_adjusted.strftime(API_DATE_FORMAT)
-            finish_date_str = finish_dt_adjusted.strftime(API_DATE_FORMAT)
-            
-            historical_overrides = _get_historical_overrides(start_date_str, finish_date_str, headers)
-        else:
-            print("[INFO] Nenhuma data fornecida. Gerando relatório de estado atual.")
+        try:
+            start_date_str, finish_date_str = _parse_report_period(data)
+            engine = _requested_engine(data)
+            query = _requested_report_query(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if query is not None:
+            timings = StageTimings()
+            page = _query_report(start_date_str, finish_date_str, query, engine, progress=timings)
+            with timings.measure("serialize"):
+                response = jsonify(page)
+            return timings.apply(response)
+        return _report_response(start_date_str, finish_date_str, _requested_stream_format(data), engine)
 
-        # 3. Monta o relatório final sempre com base na lista geral de ativos
-        active_persons = [p for p in caches["persons"].values() if p.get('personSituationId') in [1, 2]]
-        print(f"[INFO] Montando relatório final com base em {len(active_persons)} colaboradores ativos.")
-        
-        database_completa = []
-        for person_details in active_persons:
-            # 4. Para cada pessoa, constrói o registro aplicando as sobrescritas históricas (se existirem)
-            registro = _build_complete_record(person_details, caches, headers, historical_overrides)
-            database_completa.append(registro)
-        
-        # 5. Reordena a lista para colocar os colaboradores com dados históricos no topo
-        overridden_person_ids = set(historical_overrides.get("workplaces", {}).keys()) | set(historical_overrides.get("schedules", {}).keys())
-        if overridden_person_ids:
-            print(f"  > Reordenando relatório para priorizar {len(overridden_person_ids)} colaboradores com dados históricos.")
-            # A função 'key' retorna 0 para quem deve vir primeiro, e 1 para os demais.
-            database_completa.sort(key=lambda record: 0 if record.get('ID Colaborador') in overridden_person_ids else 1)
+    except HTTPError as http_err:
+        return jsonify({"error": f"Erro na API Nexti: {http_err}"}), http_err.response.status_code if http_err.response else 500
+    except Exception as e:
+        print(f"[ERRO GERAL] Um erro inesperado ocorreu: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+
+
+
+# --- EXPORTAÇÃO DO RELATÓRIO (CSV / XLSX) GERADA NO SERVIDOR ---
+def _export_rows(records, generated_at):
+    for record in records:
+        yield [generated_at if key == "Hora" else record.get(key) for _, key, _ in EXPORT_COLUMNS]
+
+def _export_csv(records, generated_at):
+    """CSV em streaming (';' e BOM UTF-8, para o Excel abrir com acentos); memória constante."""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        buffer.write('\ufeff')
+        writer.writerow([header for header, _, _ in EXPORT_COLUMNS])
+        for index, row in enumerate(_export_rows(records, generated_at), 1):
+            writer.writerow(row)
+            if index % STREAM_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={EXPORT_FILENAME}.csv'})
+
+def _export_xlsx(records, generated_at):
+    """
+    XLSX no modo write-only do openpyxl (as linhas vão direto para o disco, sem manter a
+    planilha em memória), com o mesmo visual da planilha que o painel gerava no navegador.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
 
-        return jsonify(database_completa)
+    thin = Side(style="thin", color="000000")
+    border = Border(top=thin, left=thin, bottom=thin, right=thin)
+    header_font, body_font = Font(name="Sans-Serif", size=10, bold=True), Font(name="Sans-Serif", size=8)
+    header_fill = PatternFill(fill_type="solid", fgColor="9fc5e8")
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Colaboradores")
+    for index, (_, _, width) in enumerate(EXPORT_COLUMNS, 1):
+        worksheet.column_dimensions[get_column_letter(index)].width = width
+    worksheet.auto_filter.ref = f"A1:{get_column_letter(len(EXPORT_COLUMNS))}1"
+
+    def styled(worksheet, value, font, fill=None):
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.font, cell.border = font, border
+        if fill is not None: cell.fill = fill
+        return cell
+
+    worksheet.append([styled(worksheet, header, header_font, header_fill) for header, _, _ in EXPORT_COLUMNS])
+    for row in _export_rows(records, generated_at):
+        worksheet.append([styled(worksheet, value, body_font) for value in row])
+
+    temp_file = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    temp_file.close()
+    try:
+        workbook.save(temp_file.name)
+        file_size = os.path.getsize(temp_file.name)
+    except Exception:
+        # Sem resposta não há call_on_close: o arquivo precisa ser apagado aqui.
+        os.remove(temp_file.name)
+        raise
+
+    def generate():
+        with open(temp_file.name, "rb") as fh:
+            while chunk := fh.read(64 * 1024):
+                yield chunk
+
+    def remove_temp_file():
+        try:
+            os.remove(temp_file.name)
+        except FileNotFoundError:
+            pass
+
+    response = Response(generate(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                        headers={'Content-Disposition': f'attachment; filename={EXPORT_FILENAME}.xlsx',
+                                 'Content-Length': str(file_size)})
+    # Remove o arquivo temporário mesmo se o cliente desconectar antes do fim do download.
+    response.call_on_close(remove_temp_file)
+    return response
+
+@nexti_bp.route('/colaboradores_export', methods=['POST'])
+@jwt_required()
+def export_colaboradores():
+    """
+    Exporta o relatório direto do servidor: '?format=xlsx' (padrão) ou '?format=csv'.
+    Aceita o mesmo corpo de '/colaboradores_data' (período opcional).
+    """
+    try:
+        export_format = request.args.get('format', 'xlsx').lower()
+        if export_format not in ('csv', 'xlsx'):
+            return jsonify({"error": f"Formato não suportado: {export_format}"}), 400
+        data = request.get_json(silent=True) or {}
+        try:
+            start_date_str, finish_date_str = _parse_report_period(data)
+            engine = _requested_engine(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        timings = StageTimings()
+        records = _get_report(start_date_str, finish_date_str, stream=True, progress=timings, engine=engine)
+        generated_at = datetime.now(NEXTI_TIMEZONE).strftime("%d/%m/%Y %H:%M:%S")
+        if export_format == 'csv':
+            return timings.apply(_export_csv(records, generated_at))
+        return timings.apply(_export_xlsx(records, generated_at))
 
     except HTTPError as http_err:
         return jsonify({"error": f"Erro na API Nexti: {http_err}"}), http_err.response.status_code if http_err.response else 500
     except Exception as e:
-        print(f"[ERRO GERAL] Um erro inesperado ocorreu: {e}")
+        print(f"[ERRO GERAL] Falha ao exportar relatório: {e}")
         return jsonify({"error": str(e)}), 500
 
+# --- RELATÓRIO EM SEGUNDO PLANO (JOB + ACOMPANHAMENTO DE PROGRESSO) ---
+@nexti_bp.route('/jobs', methods=['POST'])
+@jwt_required()
+def submit_report_job():
+    """
+    Agenda o relatório e responde na hora com o id do job (202).
+    Aceita o mesmo corpo de '/colaboradores_data'; pedidos iguais em andamento são reaproveitados.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        start_date_str, finish_date_str = _parse_report_period(data)
+    except ValueError as e:
+        return jsonify({"error": f"Data inválida: {e}"}), 400
+    try:
+        engine = _requested_engine(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job, coalesced = report_jobs.submit(
+        # O motor entra na chave: um pedido 'pandas' não reaproveita um job 'python' do mesmo período.
+        f"{_report_key(start_date_str, finish_date_str)}:{engine}",
+        REPORT_STAGES,
+        lambda progress: _get_report(start_date_str, finish_date_str, progress=progress, engine=engine),
+        result_key=_report_key(start_date_str, finish_date_str),
+    )
+    return jsonify({**job.to_dict(), "coalesced": coalesced}), 202
 
+@nexti_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_report_job(job_id):
+    """Status, percentual, etapas e log do job. '?log_offset=N' devolve só as linhas novas do log."""
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado ou expirado."}), 404
+    return jsonify(job.to_dict(log_offset=request.args.get('log_offset', 0, type=int)))
 
+@nexti_bp.route('/jobs/<job_id>/result', methods=['GET'])
+@jwt_required()
+def get_report_job_result(job_id):
+    """Linhas do relatório quando o job termina; 202 enquanto ainda está rodando."""
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado ou expirado."}), 404
+    if job.status == "error":
+        return jsonify({"error": job.error}), 500
+    if job.status != "done":
+        return jsonify(job.to_dict()), 202
+    rows = job.result
+    if rows is None and nexti_store:
+        # Job de outro worker: as linhas vêm do relatório que o pipeline salvou no armazenamento local.
+        rows = nexti_store.load_report(job.result_key, max_age=report_jobs.result_ttl)
+    if rows is None:
+        return jsonify({"error": "Resultado do job não encontrado ou expirado."}), 404
+    stream_format = _requested_stream_format()
+    if stream_format:
+        return _stream_response(rows, stream_format)
+    return jsonify(rows)
 
+# --- ROTA PARA INVALIDAR O CACHE DE DADOS DE REFERÊNCIA ---
+@nexti_bp.route('/cache/invalidate', methods=['POST'])
+@jwt_required()
+def invalidate_reference_cache():
+    """
+    Força o próximo relatório a baixar de novo os catálogos da Nexti.
+    Corpo opcional: {"resource": "persons"}; sem ele, todo o cache é descartado.
+    """
+    data = request.get_json(silent=True) or {}
+    resource = data.get('resource')
+    if resource and resource not in REFERENCE_RESOURCES:
+        return jsonify({"error": f"Recurso desconhecido: {resource}"}), 400
+    reference_cache.invalidate(resource)
+    if resource is None:
+        override_cache.invalidate()
+    if nexti_store:
+        nexti_store.invalidate_catalog(resource)
+        nexti_store.invalidate_reports()
+    with _memory_reports_lock:
+        _memory_reports.clear()
+    print(f"[INFO] Cache de referência invalidado: {resource or 'todos os recursos'}.")
+    return jsonify({"invalidated": resource or "all"})
 
 # --- ROTA PARA O GOOGLE SHEETS COM A SUA LÓGICA DE DUPLA VERIFICAÇÃO ---
 @nexti_bp.route('/google_sheet_sync', methods=['GET'])
@@ -255,27 +1226,22 @@ def google_sheet_sync():
         # Se ambas as verificações passaram, a ação é autorizada.
         
         # --- LÓGICA PRINCIPAL PARA BUSCAR DADOS (MODO ESTADO ATUAL) ---
-        access_token_nexti = get_nexti_access_token()
-        if not access_token_nexti: raise Exception("Falha na autenticação com a API da Nexti.")
-        headers = {'Authorization': f'Bearer {access_token_nexti}'}
-        caches = {
-            "persons": _populate_cache_from_all_endpoint("persons", headers),
-            "workplaces": _populate_cache_from_all_endpoint("workplaces", headers),
-            "companies": _populate_cache_from_all_endpoint("companies", headers),
-            "clients": _populate_cache_from_all_endpoint("clients", headers),
-            "careers": _populate_cache_from_all_endpoint("careers", headers),
-            "schedules": _populate_cache_from_all_endpoint("schedules", headers),
-            "situations": {}, "business_units": {}
-        }
-        active_persons = [p for p in caches["persons"].values() if p.get('personSituationId') in [1, 2]]
-        print(f"[INFO] Montando relatório com base em {len(active_persons)} colaboradores ativos.")
-        database_completa = []
-        for person_details in active_persons:
-            # Para a rota do Google Sheets, não há dados históricos, então 'overrides' é um dicionário vazio.
-            registro = _build_complete_record(person_details, caches, headers, {})
-            database_completa.append(registro)
-
-        return jsonify(database_completa)
+        # Para a rota do Google Sheets, não há dados históricos, então não há sobrescritas.
+        engine = _requested_engine()
+        # Modo incremental: '?since=<etag da última sincronização>' devolve só o que mudou desde então.
+        since = request.args.get('since')
+        if since is not None:
+            since = since.removeprefix('W/').strip('"')
+            timings = StageTimings()
+            rows, etag = _get_report(progress=timings, engine=engine, with_etag=True)
+            with timings.measure("diff"):
+                diff = _report_diff(since, rows, etag)
+            with timings.measure("serialize"):
+                response = jsonify(diff)
+            return timings.apply(_with_etag(response, etag))
+
+        # Apps Script pode reenviar o ETag recebido em 'If-None-Match': sem mudanças, a resposta é um 304 vazio.
+        return _report_response(None, None, _requested_stream_format(), engine)
 
     except Exception as e:
         print(f"[ERRO GERAL] Um erro inesperado ocorreu na rota de sync: {e}")
@@ -0,0 +1,246 @@
+"""
+Cache de dados de referência da Nexti (pessoas, postos, empresas, clientes,
+cargos, escalas...).
+
+Os catálogos baixados ficam em memória, compartilhados por todas as
+requisições do processo, com TTL por recurso. Opcionalmente (NEXTI_CACHE_DIR)
+eles também são gravados em disco, para que os workers do gunicorn
+reaproveitem o download feito por outro worker.
+
+Configuração (variáveis de ambiente):
+    NEXTI_CACHE_TTL               TTL padrão em segundos (300)
+    NEXTI_CACHE_TTL_<RECURSO>     TTL específico, ex.: NEXTI_CACHE_TTL_PERSONS=120
+    NEXTI_CACHE_MAX_ITEMS         maior catálogo aceito no cache (200000 itens)
+    NEXTI_CACHE_MAX_ENTRIES       número máximo de chaves em memória (LRU, 256)
+    NEXTI_CACHE_DIR               diretório do cache em disco (desligado se vazio)
+    NEXTI_OVERRIDES_TTL           TTL das fatias de histórico do dia corrente (120)
+    NEXTI_OVERRIDES_MAX_DAYS      dias de histórico mantidos em memória (LRU, 400)
+"""
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from metrics import counter
+
+load_dotenv()
+
+CACHE_LOOKUPS = counter("nexti_cache_lookups_total",
+                        "Consultas aos caches da Nexti: hit (memória), disk, expired ou miss",
+                        ("cache", "resource", "result"))
+
+_SAFE_KEY = re.compile(r"[^A-Za-z0-9_.-]")
+_DAY_SUFFIX = re.compile(r"\.\d{8}$")
+
+
+class ReferenceCache:
+    """
+    Cache chave → valor com TTL, limite de tamanho e invalidação explícita.
+
+    As entradas expiradas não são descartadas imediatamente: continuam
+    disponíveis via ``get(key, allow_stale=True)`` para servir de reserva
+    quando a API da Nexti estiver fora do ar.
+    """
+
+    def __init__(self, default_ttl=300, ttl_overrides=None, max_items=200000,
+                 max_entries=256, cache_dir=None, name="reference"):
+        self.name = name
+        self.default_ttl = default_ttl
+        self.ttl_overrides = dict(ttl_overrides or {})
+        self.max_items = max_items
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir or None
+        self._entries: "OrderedDict[str, tuple[object, float, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def ttl_for(self, key):
+        """TTL (segundos) do recurso; ``None`` significa sem expiração."""
+        return self.ttl_overrides.get(key, self.default_ttl)
+
+    def get(self, key, allow_stale=False):
+        """Retorna o valor em cache ou ``None`` se ausente/expirado."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._invalidated_since(key, entry[2]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        result = "hit"
+        if entry is None or self._expired(entry, now):
+            # Ausente ou vencida em memória: outro worker pode ter gravado uma cópia nova em disco.
+            disk_entry = self._read_disk(key)
+            if disk_entry is not None and (entry is None or disk_entry[2] > entry[2]):
+                entry, result = disk_entry, "disk"
+                with self._lock:
+                    self._store(key, entry)
+            if entry is None:
+                self._count(key, "miss")
+                return None
+
+        if not allow_stale and self._expired(entry, now):
+            self._count(key, "expired")
+            return None
+        self._count(key, result)
+        return entry[0]
+
+    def set(self, key, value, ttl=...):
+        """
+        Guarda ``value`` sob ``key``. Sem ``ttl`` usa o TTL configurado para o
+        recurso; ``ttl=None`` guarda sem expiração.
+        """
+        if hasattr(value, "__len__") and len(value) > self.max_items:
+            print(f"  [AVISO] '{key}' tem {len(value)} itens (limite {self.max_items}); não será mantido em cache.")
+            return
+        if ttl is ...:
+            ttl = self.ttl_for(key)
+        now = time.time()
+        entry = (value, now + ttl if ttl is not None else None, now)
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+    def invalidate(self, key=None):
+        """Descarta uma chave (ou todo o cache, se ``key`` for ``None``)."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if not self.cache_dir:
+            return
+        # O marcador avisa os outros workers de que a cópia em memória deles
+        # também deixou de valer.
+        marker = self._marker_path(key)
+        with open(marker, "w", encoding="utf-8"):
+            pass
+        keys = [key] if key is not None else [
+            name[:-4] for name in os.listdir(self.cache_dir) if name.endswith(".pkl")
+        ]
+        for k in keys:
+            try:
+                os.remove(self._data_path(k))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Resumo das chaves em memória (para diagnóstico)."""
+        now = time.time()
+        with self._lock:
+            return {
+                key: {
+                    "items": len(value) if hasattr(value, "__len__") else None,
+                    "age_seconds": round(now - stored_at, 1),
+                    "expired": expires_at is not None and expires_at <= now,
+                }
+                for key, (value, expires_at, stored_at) in self._entries.items()
+            }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _count(self, key, result):
+        # As fatias diárias ('workplacetransfers.20250101') somam juntas no rótulo do recurso.
+        CACHE_LOOKUPS.labels(self.name, _DAY_SUFFIX.sub("", key), result).inc()
+
+    @staticmethod
+    def _expired(entry, now):
+        expires_at = entry[1]
+        return expires_at is not None and expires_at <= now
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _data_path(self, key):
+        return os.path.join(self.cache_dir, f"{_SAFE_KEY.sub('_', key)}.pkl")
+
+    def _marker_path(self, key):
+        name = "_all" if key is None else _SAFE_KEY.sub("_", key)
+        return os.path.join(self.cache_dir, f"{name}.invalidated")
+
+    def _invalidated_since(self, key, stored_at):
+        if not self.cache_dir:
+            return False
+        for marker in (self._marker_path(None), self._marker_path(key)):
+            try:
+                if os.path.getmtime(marker) > stored_at:
+                    return True
+            except OSError:
+                continue
+        return False
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._data_path(key), "rb") as fh:
+                entry = pickle.load(fh)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        if self._invalidated_since(key, entry[2]):
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        # Grava em arquivo temporário e troca atomicamente, para que outro
+        # worker nunca leia um pickle pela metade.
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._data_path(key))
+        except OSError as e:
+            print(f"  [AVISO] Falha ao gravar cache em disco para '{key}': {e}")
+
+
+def _ttl_overrides_from_env():
+    prefix = "NEXTI_CACHE_TTL_"
+    return {
+        name[len(prefix):].lower(): int(value)
+        for name, value in os.environ.items()
+        if name.startswith(prefix) and value.strip()
+    }
+
+
+# Versão do formato dos valores gravados em disco; mudou quando os catálogos passaram a
+# guardar projeções (nexti_models.py) em vez do JSON bruto. Cada versão usa seu subdiretório.
+CACHE_FORMAT_VERSION = 2
+
+_cache_dir = os.getenv("NEXTI_CACHE_DIR") or None
+if _cache_dir:
+    _cache_dir = os.path.join(_cache_dir, f"v{CACHE_FORMAT_VERSION}")
+
+# Instâncias únicas por processo, usadas pelo blueprint da Nexti.
+reference_cache = ReferenceCache(
+    default_ttl=int(os.getenv("NEXTI_CACHE_TTL", "300")),
+    ttl_overrides=_ttl_overrides_from_env(),
+    max_items=int(os.getenv("NEXTI_CACHE_MAX_ITEMS", "200000")),
+    max_entries=int(os.getenv("NEXTI_CACHE_MAX_ENTRIES", "256")),
+    cache_dir=_cache_dir,
+)
+# Fatias diárias do histórico de transferências (duas por dia: postos e turnos). Ficam num
+# cache separado para que um período longo não expulse os catálogos pelo LRU.
+override_cache = ReferenceCache(
+    default_ttl=int(os.getenv("NEXTI_OVERRIDES_TTL", "120")),
+    max_items=int(os.getenv("NEXTI_CACHE_MAX_ITEMS", "200000")),
+    max_entries=2 * int(os.getenv("NEXTI_OVERRIDES_MAX_DAYS", "400")),
+    cache_dir=os.path.join(_cache_dir, "overrides") if _cache_dir else None,
+    name="overrides",
+)
@@ -0,0 +1,207 @@
+"""
+Cliente HTTP da API da Nexti.
+
+Todas as chamadas à Nexti passam por uma única ``requests.Session`` com pool
+de conexões keep-alive, retry com backoff para 429/5xx e compressão gzip,
+para que as milhares de consultas de um relatório não paguem um handshake
+TCP+TLS cada uma. Cada chamada entra nas métricas (metrics.py): contagem por
+endpoint e status, duração e bytes recebidos.
+
+Configuração (variáveis de ambiente):
+    NEXTI_HTTP_POOL_SIZE   conexões mantidas abertas por host (20)
+    NEXTI_HTTP_RETRIES     tentativas extras em 429/5xx/falha de conexão (3)
+    NEXTI_HTTP_BACKOFF     fator de backoff exponencial em segundos (0.5)
+    NEXTI_TOKEN_REFRESH_MARGIN  segundos antes do 'expires_in' em que o token é renovado (60)
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import counter, histogram
+
+load_dotenv()
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+NEXTI_HTTP_REQUESTS = counter("nexti_http_requests_total", "Chamadas à API da Nexti (status HTTP ou tipo do erro)",
+                              ("endpoint", "status"))
+NEXTI_HTTP_SECONDS = histogram("nexti_http_request_duration_seconds",
+                               "Duração das chamadas à API da Nexti, com as novas tentativas", ("endpoint",))
+NEXTI_HTTP_BYTES = counter("nexti_http_response_bytes_total", "Bytes recebidos da API da Nexti (corpo descomprimido)",
+                           ("endpoint",))
+
+
+class NextiClient:
+    """Sessão HTTP compartilhada para a API da Nexti (thread-safe para GET/POST)."""
+
+    def __init__(self, base_url, pool_size=20, retries=3, backoff_factor=0.5):
+        self.base_url = (base_url or "").rstrip("/")
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset({"GET", "POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,  # após esgotar as tentativas, devolve a resposta para raise_for_status()
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+
+    def url(self, path):
+        """Monta a URL completa a partir de um caminho ('/persons/all') ou devolve a URL absoluta."""
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path, **kwargs):
+        return self._request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self._request("POST", path, **kwargs)
+
+    def _request(self, method, path, **kwargs):
+        endpoint = _endpoint_label(path)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+        except requests.exceptions.RequestException as e:
+            NEXTI_HTTP_REQUESTS.labels(endpoint, type(e).__name__).inc()
+            raise
+        finally:
+            NEXTI_HTTP_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        NEXTI_HTTP_REQUESTS.labels(endpoint, response.status_code).inc()
+        NEXTI_HTTP_BYTES.labels(endpoint).inc(len(response.content))
+        return response
+
+
+def _endpoint_label(path):
+    # Primeiro segmento do caminho ('persons', 'personSituations'...): poucos valores distintos,
+    # mesmo com ids e datas na URL.
+    return urlsplit(path).path.strip("/").split("/")[0] or "/"
+
+
+class NextiTokenManager:
+    """
+    Guarda o access token OAuth da Nexti até pouco antes do 'expires_in'.
+
+    - Um timer renova o token em segundo plano antes de ele vencer, então as
+      requisições de relatório não esperam pelo round trip do OAuth.
+    - Se o token já venceu (ou nunca foi obtido), a renovação é síncrona, mas
+      apenas um thread chama o endpoint; os demais aguardam o resultado.
+    """
+
+    def __init__(self, client, client_id, client_secret, refresh_margin=60):
+        self.client = client
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._state_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+
+    def get_token(self):
+        """Devolve um token válido (ou ``None`` se a Nexti recusar/estiver fora)."""
+        token, expires_at = self._current()
+        now = time.monotonic()
+        if token and now < expires_at - self.refresh_margin:
+            return token
+        if token and now < expires_at:
+            # Ainda vale, mas está perto de vencer: renova sem bloquear quem pediu.
+            self._refresh_in_background()
+            return token
+        with self._refresh_lock:
+            token, expires_at = self._current()
+            if token and time.monotonic() < expires_at:
+                return token  # outro thread renovou enquanto esperávamos
+            return self._fetch()
+
+    def invalidate(self):
+        """Descarta o token atual (ex.: a Nexti respondeu 401)."""
+        with self._state_lock:
+            self._token, self._expires_at = None, 0.0
+
+    def renew(self, rejected_token):
+        """
+        Token novo depois de a Nexti recusar ``rejected_token`` (401: revogado ou trocado).
+        Vários threads recebendo 401 ao mesmo tempo geram uma única renovação.
+        """
+        with self._refresh_lock:
+            token, expires_at = self._current()
+            if token and token != rejected_token and time.monotonic() < expires_at:
+                return token  # outro thread já renovou
+            self.invalidate()
+            return self._fetch()
+
+    def _current(self):
+        with self._state_lock:
+            return self._token, self._expires_at
+
+    def _refresh_in_background(self):
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # já existe uma renovação em andamento
+
+        def run():
+            try:
+                self._fetch()
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=run, name="nexti-token-refresh", daemon=True).start()
+
+    def _fetch(self):
+        params = {'grant_type': 'client_credentials', 'client_id': self.client_id, 'client_secret': self.client_secret}
+        try:
+            response = self.client.post("/security/oauth/token", params=params,
+                                        auth=(self.client_id, self.client_secret), timeout=20)
+            response.raise_for_status()
+            payload = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"[ERRO DE CONEXÃO] Falha ao obter token da Nexti: {e}")
+            token, expires_at = self._current()
+            return token if token and time.monotonic() < expires_at else None
+
+        token = payload.get('access_token')
+        expires_in = float(payload.get('expires_in') or 0)
+        with self._state_lock:
+            self._token = token
+            self._expires_at = time.monotonic() + expires_in
+        if token and expires_in > self.refresh_margin:
+            self._schedule_refresh(expires_in - self.refresh_margin)
+        return token
+
+    def _schedule_refresh(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+# Instâncias únicas por processo, compartilhadas por todas as requisições.
+nexti_client = NextiClient(
+    os.getenv("NEXTI_API_URL"),
+    pool_size=int(os.getenv("NEXTI_HTTP_POOL_SIZE", "20")),
+    retries=int(os.getenv("NEXTI_HTTP_RETRIES", "3")),
+    backoff_factor=float(os.getenv("NEXTI_HTTP_BACKOFF", "0.5")),
+)
+nexti_token_manager = NextiTokenManager(
+    nexti_client,
+    os.getenv("NEXTI_CLIENT_ID"),
+    os.getenv("NEXTI_API_TOKEN"),
+    refresh_margin=int(os.getenv("NEXTI_TOKEN_REFRESH_MARGIN", "60")),
+)
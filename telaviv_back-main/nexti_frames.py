@@ -0,0 +1,141 @@
+"""
+Motor vetorizado (pandas) do relatório de colaboradores da Nexti.
+
+Produz as mesmas linhas de ``_build_complete_record`` (nexti_api.py), mas em
+vez de percorrer os colaboradores um a um com consultas encadeadas nos
+dicionários de cache, carrega colaboradores e catálogos como DataFrames e
+monta o relatório com merges e operações de coluna.
+
+Todas as colunas são criadas com dtype ``object``: assim ids continuam
+inteiros (sem virar float por causa de valores ausentes) e os textos saem
+exatamente como vieram da API. Ausências viram ``None`` no final, como no
+montador linha a linha. Colaboradores e catálogos chegam como as projeções
+de nexti_models.py.
+
+Escolha do motor: NEXTI_REPORT_ENGINE=pandas (ou ``"engine": "pandas"`` no
+pedido). Com NEXTI_REPORT_ENGINE_VERIFY=1 o motor pandas também roda o
+montador original e registra no log as linhas divergentes.
+"""
+import pandas as pd
+
+from nexti_models import MODELS, Person
+
+# Colunas do registro final, na mesma ordem de _build_complete_record
+RECORD_COLUMNS = (
+    "Matricula", "Nome Colaborador", "CPF", "Data Admissao", "Data Demissao", "Nome Posto de Trabalho",
+    "Razao Social Empresa", "Cliente", "Unidade de Negocio", "Descricao Cargo", "Descricao Situacao",
+    "Cronograma", "Horario", "Turno", "ID Colaborador",
+)
+NO_SCHEDULE = ("", "N/A", "")
+
+
+def _column(values):
+    return pd.Series(values, dtype=object)
+
+
+def _persons_frame(persons):
+    # As projeções são tuplas: cada campo vira uma coluna, na ordem de Person._fields.
+    return pd.DataFrame(persons, columns=list(Person._fields), dtype=object)
+
+
+def _catalog_frame(catalog, resource, key, fields):
+    """Catálogo id → projeção como DataFrame ``key`` + ``fields`` (colunas renomeadas)."""
+    frame = pd.DataFrame(list(catalog.values()), columns=list(MODELS[resource]._fields), dtype=object)
+    frame = frame[list(fields)].rename(columns=fields)
+    frame.insert(0, key, _column(list(catalog.keys())))
+    return frame
+
+
+def _lookup(frame, caches, resource, key, fields):
+    # merge 'left' preserva a ordem dos colaboradores; ids de catálogo são únicos.
+    return frame.merge(_catalog_frame(caches[resource], resource, key, fields), on=key, how="left", sort=False)
+
+
+def _apply_override(frame, column, overrides):
+    """Valor histórico quando o colaborador tem sobrescrita (mesmo que seja None), senão o atual."""
+    if not overrides:
+        return frame[column]
+    # Montado em Python e não com Series.map: o map converte ids inteiros para float64 quando
+    # falta algum colaborador no dicionário, e o turno sairia "T:1.0" em vez de "T:1".
+    values = [overrides[person_id] if person_id in overrides else current
+              for person_id, current in zip(frame["id"].tolist(), frame[column].tolist())]
+    return pd.Series(values, index=frame.index, dtype=object)
+
+
+def build_report_frame(active_persons, caches, overrides):
+    """DataFrame do relatório (uma linha por colaborador, na ordem de ``active_persons``)."""
+    frame = _persons_frame(active_persons)
+    frame["workplaceId"] = _apply_override(frame, "workplaceId", overrides.get("workplaces", {}))
+    frame["rotationCode"] = _apply_override(frame, "rotationCode", overrides.get("schedules", {}))
+
+    frame = _lookup(frame, caches, "workplaces", "workplaceId",
+                    {"name": "workplace_name", "clientId": "clientId", "businessUnitId": "businessUnitId"})
+    frame = _lookup(frame, caches, "clients", "clientId", {"name": "client_name"})
+    frame = _lookup(frame, caches, "companies", "companyId", {"companyName": "company_name"})
+    frame = _lookup(frame, caches, "careers", "careerId", {"name": "career_name"})
+    frame = _lookup(frame, caches, "situations", "personSituationId", {"description": "situation_description"})
+    frame = _lookup(frame, caches, "business_units", "businessUnitId", {"name": "business_unit_name"})
+
+    parts = caches["schedule_parts"]
+    schedules = pd.DataFrame({
+        "scheduleId": _column(list(parts.keys())),
+        "cronograma": _column([p[0] for p in parts.values()]),
+        "horario": _column([p[1] for p in parts.values()]),
+        "turno_base": _column([p[2] for p in parts.values()]),
+        "has_schedule": _column([True] * len(parts)),
+    })
+    frame = frame.merge(schedules, on="scheduleId", how="left", sort=False)
+    # Escala desconhecida: mesmos valores padrão do montador linha a linha.
+    no_schedule = frame["has_schedule"].isna()
+    for column, default in zip(("cronograma", "horario", "turno_base"), NO_SCHEDULE):
+        frame.loc[no_schedule, column] = default
+
+    rotation = frame["rotationCode"]
+    has_rotation = rotation.notna()
+    rotation_label = "T:" + rotation.astype(str)
+    turno_base = frame["turno_base"]
+    turno = turno_base.where(~has_rotation, rotation_label.where(turno_base == "", turno_base + " - " + rotation_label))
+    turno = turno.where(turno != "", "N/A")
+
+    workplace_name = frame["workplace_name"]
+    has_workplace_name = workplace_name.notna() & (workplace_name != "")
+    posto = ("Posto - " + workplace_name.astype(str)).where(has_workplace_name, None)
+
+    report = pd.DataFrame({
+        "Matricula": frame["enrolment"], "Nome Colaborador": frame["name"],
+        "CPF": frame["cpf"], "Data Admissao": frame["admissionDate"],
+        "Data Demissao": frame["demissionDate"], "Nome Posto de Trabalho": posto,
+        "Razao Social Empresa": frame["company_name"], "Cliente": frame["client_name"],
+        "Unidade de Negocio": frame["business_unit_name"], "Descricao Cargo": frame["career_name"],
+        "Descricao Situacao": frame["situation_description"], "Cronograma": frame["cronograma"],
+        "Horario": frame["horario"], "Turno": turno, "ID Colaborador": frame["id"],
+    }, columns=list(RECORD_COLUMNS)).astype(object)
+    # NaN dos merges sem correspondência → None, como o dict.get do montador original.
+    return report.where(report.notna(), None)
+
+
+def build_report_records(active_persons, caches, overrides):
+    """Linhas do relatório como lista de dicts (mesmo formato de _build_complete_record)."""
+    if not active_persons:
+        return []
+    report = build_report_frame(active_persons, caches, overrides)
+    # Mais rápido que DataFrame.to_dict("records"): uma lista Python por coluna, depois zip por linha.
+    columns = list(report.columns)
+    return [dict(zip(columns, row)) for row in zip(*(report[column].tolist() for column in columns))]
+
+
+def find_mismatches(expected, actual, limit=20):
+    """
+    Compara as linhas dos dois motores. Devolve até ``limit`` divergências como
+    ``(posição, coluna, esperado, obtido)``; lista vazia quando são idênticas.
+    """
+    mismatches = []
+    if len(expected) != len(actual):
+        mismatches.append((None, "linhas", len(expected), len(actual)))
+    for position, (expected_row, actual_row) in enumerate(zip(expected, actual)):
+        for column in RECORD_COLUMNS:
+            if expected_row.get(column) != actual_row.get(column):
+                mismatches.append((position, column, expected_row.get(column), actual_row.get(column)))
+                if len(mismatches) >= limit:
+                    return mismatches
+    return mismatches
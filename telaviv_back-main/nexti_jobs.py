@@ -0,0 +1,201 @@
+"""
+Execução de relatórios da Nexti em segundo plano.
+
+Uma requisição cria um job e recebe o id na hora; o relatório roda em um
+thread próprio, publicando o progresso de cada etapa (token, catálogos,
+sobrescritas históricas, montagem das linhas). O cliente consulta o status
+e baixa o resultado quando ficar pronto. Pedidos iguais enquanto um job
+ainda está na fila ou em andamento reaproveitam o mesmo job.
+
+O job roda no worker que recebeu o pedido. Com o armazenamento local ligado
+(NEXTI_STORE_PATH, nexti_store.py) o estado de cada job também é gravado lá,
+então os outros workers do gunicorn no mesmo host respondem ao acompanhamento,
+e o resultado vem do relatório salvo pelo próprio pipeline. Sem ele, só o
+worker que recebeu o pedido conhece o job; nos demais (e em ambientes sem
+threads em segundo plano, como o Vercel) as consultas respondem 404 e o
+painel refaz o pedido em '/colaboradores_data'.
+
+Configuração (variáveis de ambiente):
+    NEXTI_JOB_WORKERS      relatórios executados ao mesmo tempo (2)
+    NEXTI_JOB_RESULT_TTL   segundos que um resultado pronto fica disponível (600)
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from nexti_store import nexti_store
+
+load_dotenv()
+
+
+class ReportJob:
+    """Estado de um relatório em execução; atualizado pelo thread do job, lido pelas rotas."""
+
+    def __init__(self, key, stages, result_key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.result_key = result_key  # chave do relatório no armazenamento local (resultado em outro worker)
+        self.status = "queued"
+        self.stages = {stage: {"status": "pending", "detail": None} for stage in stages}
+        self.log = []
+        self.result = None
+        self.rows = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.on_change = None  # chamado com o estado a cada mudança (gravação no armazenamento local)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_state(cls, state):
+        """Job de outro worker, reconstruído do estado gravado (sem as linhas do resultado)."""
+        job = cls(state["key"], (), state.get("result_key"))
+        job.id = state["job_id"]
+        job.status = state["status"]
+        job.stages = {name: dict(stage) for name, stage in state["stages"].items()}
+        job.log = list(state["log"])
+        job.rows = state["rows"]
+        job.error = state["error"]
+        job.created_at, job.finished_at = state["created_at"], state["finished_at"]
+        return job
+
+    @property
+    def progress(self):
+        """Percentual concluído (etapas concluídas + fração da etapa em andamento)."""
+        if self.status == "done":
+            return 100
+        total = len(self.stages) or 1
+        done = 0.0
+        for stage in self.stages.values():
+            if stage["status"] == "done":
+                done += 1
+            elif stage["status"] == "running" and stage.get("fraction"):
+                done += stage["fraction"]
+        return int(done * 100 / total)
+
+    def update(self, stage, status, detail=None, fraction=None):
+        """Callback de progresso passado para o pipeline do relatório."""
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"status": "pending", "detail": None})
+            entry["status"] = status
+            if detail is not None:
+                entry["detail"] = detail
+            if fraction is not None:
+                entry["fraction"] = fraction
+            if status in ("running", "done") and fraction is None:
+                self.log.append(f"{stage}: {detail}" if detail else f"{stage}: {status}")
+            self._changed()
+
+    def start(self):
+        with self._lock:
+            self.status = "running"
+            self._changed()
+
+    def finish(self, result=None, error=None):
+        with self._lock:
+            self.result, self.error = result, error
+            self.rows = len(result) if result is not None else None
+            self.status = "error" if error else "done"
+            self.finished_at = time.time()
+            self.log.append(f"Erro: {error}" if error else "Relatório concluído.")
+            self._changed()
+
+    def to_dict(self, log_offset=0):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "progress": self.progress,
+                "stages": {name: {"status": s["status"], "detail": s["detail"]} for name, s in self.stages.items()},
+                "log": self.log[log_offset:],
+                "log_offset": len(self.log),
+                "error": self.error,
+                "rows": self.rows,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change({**self.to_dict(), "key": self.key, "result_key": self.result_key,
+                            "stages": {name: dict(stage) for name, stage in self.stages.items()}})
+
+
+class ReportJobManager:
+    def __init__(self, max_workers=2, result_ttl=600, store=None):
+        self.result_ttl = result_ttl
+        self.store = store
+        self._jobs = {}
+        self._active_by_key = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nexti-job")
+
+    def submit(self, key, stages, run, result_key=None):
+        """
+        Agenda ``run(progress)`` e devolve ``(job, coalesced)``. Se já existe um job com a
+        mesma chave na fila ou em andamento, devolve esse job. ``result_key`` é a chave com
+        que o pipeline salva o relatório no armazenamento local.
+        """
+        with self._lock:
+            self._expire_old_jobs()
+            existing = self._jobs.get(self._active_by_key.get(key))
+            if existing is not None and existing.finished_at is None:
+                return existing, True
+            job = ReportJob(key, stages, result_key)
+            if self.store:
+                # Pela mesma fila de gravação do relatório: o "done" nunca chega antes das linhas.
+                job.on_change = lambda state: self.store.submit("save_job", state["job_id"], state,
+                                                                max_age=self.result_ttl)
+                job._changed()
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job.id
+        self._executor.submit(self._run, job, run)
+        return job, False
+
+    def get(self, job_id):
+        """Job deste worker ou, com o armazenamento local, o estado gravado por outro worker."""
+        with self._lock:
+            self._expire_old_jobs()
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            state = self.store.load_job(job_id, max_age=self.result_ttl)
+            if state is not None:
+                job = ReportJob.from_state(state)
+        return job
+
+    def _run(self, job, run):
+        job.start()
+        try:
+            job.finish(result=run(job.update))
+        except Exception as e:
+            print(f"[ERRO GERAL] Job de relatório {job.id} falhou: {e}")
+            job.finish(error=str(e))
+        # Libera o resultado da memória ao fim do TTL, mesmo que ninguém mais peça um job.
+        timer = threading.Timer(self.result_ttl + 1, self._expire)
+        timer.daemon = True
+        timer.start()
+
+    def _expire(self):
+        with self._lock:
+            self._expire_old_jobs()
+
+    def _expire_old_jobs(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._active_by_key.get(job.key) == job_id:
+                del self._active_by_key[job.key]
+
+
+# Instância única por processo.
+report_jobs = ReportJobManager(
+    max_workers=int(os.getenv("NEXTI_JOB_WORKERS", "2")),
+    result_ttl=int(os.getenv("NEXTI_JOB_RESULT_TTL", "600")),
+    store=nexti_store,
+)
@@ -0,0 +1,240 @@
+"""
+Servidor local que imita a API da Nexti, com um tenant sintético.
+
+Responde aos mesmos endpoints usados por nexti_api.py (token OAuth, catálogos
+'/all' paginados, 'lastupdate' de colaboradores/postos, personSituations,
+businessUnits e transferências de posto/turno), com dados gerados de forma
+determinística a partir do tamanho e da semente, e latência configurável.
+Serve para medir o relatório sem tocar no tenant real (ver benchmark_nexti.py).
+
+Uso avulso:
+    python nexti_mock.py --persons 10000 --latency-ms 40 --port 8099
+    NEXTI_API_URL=http://127.0.0.1:8099 flask run ...
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+API_DATE_FORMAT = "%d%m%Y%H%M%S"
+# Campos que o relatório não lê, mas que a Nexti devolve: deixam o payload com tamanho realista.
+PADDING_FIELDS = ("email", "phone", "address", "district", "city", "state", "zipCode", "motherName",
+                  "fatherName", "birthDate", "gender", "nationality", "externalId", "pis", "rg")
+
+
+class SyntheticTenant:
+    """Tenant sintético com ``persons`` colaboradores (mesma semente → mesmos dados)."""
+
+    def __init__(self, persons=1000, seed=42, transfer_rate=0.002):
+        self.size = persons
+        self.seed = seed
+        self.transfer_rate = transfer_rate  # fração dos colaboradores transferidos por dia
+        rng = random.Random(seed)
+        self.workplace_count = max(1, persons // 20)
+        self.client_count = max(1, persons // 200)
+        self.business_unit_count = 20
+        self.situation_count = 5
+
+        self.catalogs = {
+            "clients": [{"id": i, "name": f"Cliente {i}"} for i in range(1, self.client_count + 1)],
+            "companies": [{"id": i, "companyName": f"Empresa {i} Ltda"} for i in range(1, 6)],
+            "careers": [{"id": i, "name": f"Cargo {i}"} for i in range(1, 51)],
+            "schedules": [
+                {"id": i, "name": f"Escala {i}, {6 + i % 12:02d}:00-{18 + i % 6:02d}:00, Turno {i % 4}"
+                 if i % 10 else f"Escala {i}"}
+                for i in range(1, 301)
+            ],
+            "workplaces": [
+                {"id": i, "name": f"Posto {i}", "clientId": rng.randint(1, self.client_count),
+                 "businessUnitId": rng.randint(1, self.business_unit_count), "active": True}
+                for i in range(1, self.workplace_count + 1)
+            ],
+        }
+        self.catalogs["persons"] = [self._person(i, rng) for i in range(1, persons + 1)]
+
+    def _person(self, person_id, rng):
+        person = {
+            "id": person_id,
+            "enrolment": f"{person_id:07d}",
+            "name": f"Colaborador {person_id}",
+            "cpf": f"{rng.randrange(10**10, 10**11)}",
+            "admissionDate": "01012020000000",
+            "demissionDate": None,
+            "workplaceId": rng.randint(1, self.workplace_count),
+            "rotationCode": rng.choice([None, 1, 2, 3, 4]),
+            "companyId": rng.randint(1, 5),
+            "careerId": rng.randint(1, 50),
+            "scheduleId": rng.randint(1, 300),
+            # Maioria ativa (1/2), como no tenant real
+            "personSituationId": rng.choices([1, 2, 3, 4, 5], weights=[80, 10, 4, 3, 3])[0],
+        }
+        person.update((field, f"{field}-{person_id}") for field in PADDING_FIELDS)
+        return person
+
+    @lru_cache(maxsize=512)
+    def transfers_for_day(self, resource, day):
+        """Transferências (posto ou turno) registradas em ``day`` (date), ordenadas por horário."""
+        rng = random.Random(f"{self.seed}-{resource}-{day.isoformat()}")
+        count = int(self.size * self.transfer_rate)
+        transfers = []
+        for index in range(count):
+            moment = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randrange(86400))
+            transfer = {
+                "id": day.toordinal() * 1_000_000 + index,
+                "personId": rng.randint(1, self.size),
+                "transferDateTime": moment.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            if resource == "workplacetransfers":
+                transfer["workplaceId"] = rng.randint(1, self.workplace_count)
+            else:
+                transfer["rotationCode"] = rng.randint(1, 4)
+            transfers.append(transfer)
+        transfers.sort(key=lambda t: t["transferDateTime"])
+        return tuple(transfers)
+
+    def transfers(self, resource, start, finish):
+        items = []
+        day = start.date()
+        while day <= finish.date():
+            items.extend(t for t in self.transfers_for_day(resource, day)
+                         if start <= datetime.strptime(t["transferDateTime"], "%Y-%m-%dT%H:%M:%S") <= finish)
+            day += timedelta(days=1)
+        return items
+
+    def recently_updated(self, resource):
+        # Uma fração pequena e fixa do catálogo "mudou" em qualquer janela (sincronização incremental).
+        return self.catalogs[resource][::1000]
+
+
+def create_mock_app(tenant, latency_ms=0, jitter_ms=0, max_page_size=10000):
+    """App Flask que responde como a Nexti para o ``tenant`` (trocável via ``app.config['TENANT']``)."""
+    app = Flask(__name__)
+    app.config["TENANT"] = tenant
+    stats = {"requests": Counter(), "bytes": 0, "lock": threading.Lock()}
+    app.extensions["nexti_mock_stats"] = stats
+    rng = random.Random()
+
+    def current_tenant():
+        return app.config["TENANT"]
+
+    @app.before_request
+    def simulate_latency_and_auth():
+        delay = latency_ms + (rng.uniform(0, jitter_ms) if jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if request.path != "/security/oauth/token" and not request.headers.get("Authorization", "").startswith("Bearer "):
+            return jsonify({"error": "unauthorized"}), 401
+
+    @app.after_request
+    def count(response):
+        endpoint = request.path.strip("/").split("/")[0]
+        with stats["lock"]:
+            stats["requests"][endpoint] += 1
+            stats["bytes"] += response.calculate_content_length() or 0
+        return response
+
+    def paginate(items):
+        page = int(request.args.get("page", 0))
+        size = min(int(request.args.get("size", max_page_size)), max_page_size)
+        total_pages = max(1, -(-len(items) // size))
+        return jsonify({"content": items[page * size:(page + 1) * size], "totalPages": total_pages,
+                        "totalElements": len(items), "last": page >= total_pages - 1, "number": page})
+
+    @app.route("/security/oauth/token", methods=["POST"])
+    def token():
+        return jsonify({"access_token": "mock-token", "token_type": "bearer", "expires_in": 3600})
+
+    @app.route("/<resource>/all")
+    def catalog(resource):
+        items = current_tenant().catalogs.get(resource)
+        if items is None:
+            return jsonify({"error": f"unknown resource {resource}"}), 404
+        return paginate(items)
+
+    @app.route("/<resource>/lastupdate/start/<start>/finish/<finish>")
+    def last_update(resource, start, finish):
+        if resource not in ("persons", "workplaces"):
+            return jsonify({"error": f"unknown resource {resource}"}), 404
+        return paginate(current_tenant().recently_updated(resource))
+
+    @app.route("/<resource>/lastupdate/nextiuser/start/<start>/finish/<finish>")
+    def transfers(resource, start, finish):
+        if resource not in ("workplacetransfers", "scheduletransfers"):
+            return jsonify({"error": f"unknown resource {resource}"}), 404
+        start_dt = datetime.strptime(start, API_DATE_FORMAT)
+        finish_dt = datetime.strptime(finish, API_DATE_FORMAT)
+        return paginate(current_tenant().transfers(resource, start_dt, finish_dt))
+
+    @app.route("/personSituations/<int:situation_id>")
+    def person_situation(situation_id):
+        return jsonify({"value": {"id": situation_id, "description": f"Situação {situation_id}"}})
+
+    @app.route("/businessUnits/<int:business_unit_id>")
+    def business_unit(business_unit_id):
+        return jsonify({"value": {"id": business_unit_id, "name": f"Unidade {business_unit_id}"}})
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass  # milhares de requisições por relatório: o log de acesso só atrapalha a medição
+
+
+class MockNextiServer:
+    """Servidor em thread própria; ``url`` fica disponível depois de ``start()``."""
+
+    def __init__(self, tenant, host="127.0.0.1", port=0, **app_options):
+        self.app = create_mock_app(tenant, **app_options)
+        self._server = make_server(host, port, self.app, threaded=True, request_handler=_QuietRequestHandler)
+        self.url = f"http://{host}:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="nexti-mock", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def set_tenant(self, tenant):
+        self.app.config["TENANT"] = tenant
+
+    def stats(self):
+        stats = self.app.extensions["nexti_mock_stats"]
+        with stats["lock"]:
+            return {"requests": dict(stats["requests"]), "bytes": stats["bytes"]}
+
+    def reset_stats(self):
+        stats = self.app.extensions["nexti_mock_stats"]
+        with stats["lock"]:
+            stats["requests"].clear()
+            stats["bytes"] = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API da Nexti.")
+    parser.add_argument("--persons", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--max-page-size", type=int, default=10000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    tenant = SyntheticTenant(args.persons, seed=args.seed)
+    app = create_mock_app(tenant, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          max_page_size=args.max_page_size)
+    print(f"Nexti simulada com {args.persons} colaboradores em http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Projeções compactas das entidades da Nexti mantidas em cache.
+
+A API devolve dezenas de campos por colaborador, posto etc., mas o relatório
+lê só uma dúzia. Cada catálogo é guardado como ``id → NamedTuple`` com apenas
+esses campos: uma tupla ocupa uma fração da memória do dict JSON original,
+é mais rápida de percorrer e continua serializável (pickle/JSON).
+
+Os nomes dos campos são os mesmos da API, então ``_asdict()`` devolve um
+dict no formato original (usado pelo armazenamento local). Campo ausente na
+resposta vira o valor padrão da projeção (``None``, salvo indicação).
+"""
+from typing import Any, NamedTuple
+
+
+class Person(NamedTuple):
+    id: Any = None
+    enrolment: Any = None
+    name: Any = None
+    cpf: Any = None
+    admissionDate: Any = None
+    demissionDate: Any = None
+    workplaceId: Any = None
+    rotationCode: Any = None
+    companyId: Any = None
+    careerId: Any = None
+    scheduleId: Any = None
+    personSituationId: Any = None
+
+
+class Workplace(NamedTuple):
+    id: Any = None
+    name: Any = None
+    clientId: Any = None
+    businessUnitId: Any = None
+
+
+class Client(NamedTuple):
+    id: Any = None
+    name: Any = None
+
+
+class Company(NamedTuple):
+    id: Any = None
+    companyName: Any = None
+
+
+class Career(NamedTuple):
+    id: Any = None
+    name: Any = None
+
+
+class Schedule(NamedTuple):
+    id: Any = None
+    name: Any = ""  # o montador trata escala sem nome como descrição vazia
+
+
+class Situation(NamedTuple):
+    id: Any = None
+    description: Any = None
+
+
+class BusinessUnit(NamedTuple):
+    id: Any = None
+    name: Any = None
+
+
+# Projeção usada por cada catálogo do cache
+MODELS = {
+    "persons": Person,
+    "workplaces": Workplace,
+    "clients": Client,
+    "companies": Company,
+    "careers": Career,
+    "schedules": Schedule,
+    "situations": Situation,
+    "business_units": BusinessUnit,
+}
+
+# Registro "vazio" de cada projeção: substitui o ``{}`` das consultas sem correspondência
+EMPTY = {resource: model() for resource, model in MODELS.items()}
+
+
+def project(resource, raw):
+    """Converte um registro da API (dict) na projeção do recurso; já projetado passa direto."""
+    model = MODELS[resource]
+    if isinstance(raw, model):
+        return raw
+    if not raw:
+        return EMPTY[resource]
+    defaults = model._field_defaults
+    return model._make([raw.get(field, defaults[field]) for field in model._fields])
+
+
+def project_catalog(resource, items):
+    """Aplica ``project`` a um catálogo ``id → registro``."""
+    return {item_id: project(resource, item) for item_id, item in items.items()}
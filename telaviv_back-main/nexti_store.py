@@ -0,0 +1,427 @@
+"""
+Armazenamento local (SQLite) dos dados da Nexti.
+
+Guarda os catálogos de referência e as linhas dos relatórios já montados em
+um arquivo SQLite embutido, com índices por colaborador, posto, cliente,
+unidade de negócio, situação e cargo. Assim os relatórios, os filtros e o feed do Google Sheets
+podem ser atendidos por consultas indexadas, e um worker recém-iniciado
+retoma o último snapshot em vez de baixar o tenant inteiro de novo.
+
+Configuração (variáveis de ambiente):
+    NEXTI_STORE_PATH   caminho do arquivo SQLite (desligado se vazio, o padrão). O arquivo
+                       guarda nomes e CPFs: é criado só com permissão do dono (0600), e o
+                       caminho deve ficar num diretório privado, não no /tmp compartilhado.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_items (
+    resource          TEXT    NOT NULL,
+    id                INTEGER NOT NULL,
+    workplace_id      INTEGER,
+    client_id         INTEGER,
+    business_unit_id  INTEGER,
+    payload           TEXT    NOT NULL,
+    PRIMARY KEY (resource, id)
+);
+CREATE INDEX IF NOT EXISTS ix_catalog_workplace     ON catalog_items (resource, workplace_id);
+CREATE INDEX IF NOT EXISTS ix_catalog_client        ON catalog_items (resource, client_id);
+CREATE INDEX IF NOT EXISTS ix_catalog_business_unit ON catalog_items (resource, business_unit_id);
+
+CREATE TABLE IF NOT EXISTS catalog_sync (
+    resource      TEXT PRIMARY KEY,
+    synced_at     TEXT NOT NULL,
+    full_sync_at  TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS reports (
+    report_key  TEXT PRIMARY KEY,
+    built_at    REAL    NOT NULL,
+    row_count   INTEGER NOT NULL,
+    etag        TEXT
+);
+
+CREATE TABLE IF NOT EXISTS report_rows (
+    report_key     TEXT    NOT NULL,
+    position       INTEGER NOT NULL,
+    person_id      INTEGER,
+    workplace      TEXT,
+    client         TEXT,
+    business_unit  TEXT,
+    situation      TEXT,
+    career         TEXT,
+    name           TEXT,
+    enrolment      TEXT,
+    cpf            TEXT,
+    search_text    TEXT,
+    payload        TEXT    NOT NULL,
+    PRIMARY KEY (report_key, position)
+);
+CREATE INDEX IF NOT EXISTS ix_report_person        ON report_rows (report_key, person_id);
+CREATE INDEX IF NOT EXISTS ix_report_workplace     ON report_rows (report_key, workplace);
+CREATE INDEX IF NOT EXISTS ix_report_client        ON report_rows (report_key, client);
+CREATE INDEX IF NOT EXISTS ix_report_business_unit ON report_rows (report_key, business_unit);
+CREATE INDEX IF NOT EXISTS ix_report_situation     ON report_rows (report_key, situation);
+CREATE INDEX IF NOT EXISTS ix_report_career        ON report_rows (report_key, career);
+
+-- Histórico das últimas versões (etags) de um relatório: hash de cada linha por colaborador,
+-- para responder "o que mudou desde a versão X" (feed incremental do Google Sheets).
+CREATE TABLE IF NOT EXISTS report_versions (
+    report_key  TEXT NOT NULL,
+    etag        TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    PRIMARY KEY (report_key, etag)
+);
+CREATE TABLE IF NOT EXISTS report_version_rows (
+    report_key  TEXT    NOT NULL,
+    etag        TEXT    NOT NULL,
+    person_id   INTEGER NOT NULL,
+    row_hash    TEXT    NOT NULL,
+    PRIMARY KEY (report_key, etag, person_id)
+);
+
+-- Estado dos jobs de relatório (nexti_jobs.py), para os outros workers acompanharem
+CREATE TABLE IF NOT EXISTS report_jobs (
+    id          TEXT PRIMARY KEY,
+    updated_at  REAL NOT NULL,
+    state       TEXT NOT NULL
+);
+"""
+# Incrementar quando o esquema mudar; os relatórios salvos (só cache) são descartados na migração.
+_SCHEMA_VERSION = 3
+
+# Colunas de report_rows usadas nos filtros/ordenação → campo correspondente da linha do relatório
+REPORT_COLUMNS = {
+    "workplace": "Nome Posto de Trabalho",
+    "client": "Cliente",
+    "business_unit": "Unidade de Negocio",
+    "situation": "Descricao Situacao",
+    "career": "Descricao Cargo",
+    "name": "Nome Colaborador",
+    "enrolment": "Matricula",
+    "cpf": "CPF",
+}
+REPORT_FILTERS = ("client", "business_unit", "workplace", "situation", "career")
+REPORT_SORT_KEYS = tuple(REPORT_COLUMNS)
+
+
+def report_column_value(row, column):
+    """Valor da coluna indexada para a linha (texto, ou None)."""
+    value = row.get(REPORT_COLUMNS[column])
+    return None if value is None else str(value)
+
+
+def report_row_digest(row):
+    """Hash de uma linha do relatório (independe da ordem das chaves)."""
+    return hashlib.sha1(json.dumps(row, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def report_search_text(row):
+    """Texto da busca livre: nome, CPF e matrícula, sem diferenciar maiúsculas."""
+    values = (row.get("Nome Colaborador"), row.get("CPF"), row.get("Matricula"))
+    return " ".join(str(value) for value in values if value is not None).casefold()
+
+
+class NextiStore:
+    """Acesso ao arquivo SQLite; uma conexão por thread, modo WAL para leitores concorrentes."""
+
+    def __init__(self, path):
+        self.path = path
+        # Cria o arquivo antes do sqlite3 só com permissão do dono; os arquivos -wal e -shm
+        # herdam as permissões dele.
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._local = threading.local()
+        # Gravações saem do caminho da requisição: um único thread escreve, em ordem.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nexti-store")
+        with self._connect() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS report_rows; DROP TABLE IF EXISTS reports;")
+            conn.executescript(_SCHEMA)
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Catálogos
+    # ------------------------------------------------------------------
+    def save_catalog(self, resource, items, sync_state, replace=True):
+        """
+        Persiste ``items`` (id → registro, dict ou projeção de nexti_models). Com ``replace=False`` só faz upsert dos
+        itens recebidos (sincronização incremental).
+        """
+        records = ((item_id, item._asdict() if hasattr(item, "_asdict") else item) for item_id, item in items.items())
+        rows = [
+            (resource, item_id, record.get("workplaceId"), record.get("clientId"), record.get("businessUnitId"),
+             json.dumps(record, ensure_ascii=False))
+            for item_id, record in records
+        ]
+        with self._connect() as conn:
+            if replace:
+                conn.execute("DELETE FROM catalog_items WHERE resource = ?", (resource,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO catalog_items "
+                "(resource, id, workplace_id, client_id, business_unit_id, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_sync (resource, synced_at, full_sync_at) VALUES (?, ?, ?)",
+                (resource, sync_state["synced_at"].isoformat(), sync_state["full_sync_at"].isoformat()),
+            )
+
+    def load_catalog(self, resource):
+        """Retorna ``(itens, sync_state)`` do último snapshot, ou ``(None, None)``."""
+        conn = self._connect()
+        sync_row = conn.execute(
+            "SELECT synced_at, full_sync_at FROM catalog_sync WHERE resource = ?", (resource,)
+        ).fetchone()
+        if sync_row is None:
+            return None, None
+        items = {
+            item_id: json.loads(payload)
+            for item_id, payload in conn.execute(
+                "SELECT id, payload FROM catalog_items WHERE resource = ?", (resource,)
+            )
+        }
+        sync_state = {"synced_at": datetime.fromisoformat(sync_row[0]),
+                      "full_sync_at": datetime.fromisoformat(sync_row[1])}
+        return items, sync_state
+
+    def invalidate_catalog(self, resource=None):
+        """Apaga o snapshot de um catálogo (ou de todos)."""
+        with self._connect() as conn:
+            if resource is None:
+                conn.execute("DELETE FROM catalog_items")
+                conn.execute("DELETE FROM catalog_sync")
+            else:
+                conn.execute("DELETE FROM catalog_items WHERE resource = ?", (resource,))
+                conn.execute("DELETE FROM catalog_sync WHERE resource = ?", (resource,))
+
+    # ------------------------------------------------------------------
+    # Relatórios
+    # ------------------------------------------------------------------
+    def save_report(self, report_key, rows, built_at=None, etag=None, keep_versions=0, row_digests=None):
+        """
+        Substitui as linhas salvas do relatório; ``etag`` identifica o conteúdo (requisições
+        condicionais). Com ``keep_versions`` > 0 a versão também entra no histórico de hashes
+        por linha, que guarda só as ``keep_versions`` mais recentes. ``row_digests`` são os
+        hashes das linhas (``report_row_digest``), se já calculados para o etag.
+        """
+        built_at = built_at or time.time()
+        columns = ", ".join(REPORT_COLUMNS)
+        values = [
+            (report_key, position, row.get("ID Colaborador"),
+             *(report_column_value(row, column) for column in REPORT_COLUMNS),
+             report_search_text(row), json.dumps(row, ensure_ascii=False))
+            for position, row in enumerate(rows)
+        ]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM report_rows WHERE report_key = ?", (report_key,))
+            conn.executemany(
+                f"INSERT INTO report_rows (report_key, position, person_id, {columns}, search_text, payload) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(REPORT_COLUMNS))}, ?, ?)",
+                values,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (report_key, built_at, row_count, etag) VALUES (?, ?, ?, ?)",
+                (report_key, built_at, len(values), etag),
+            )
+            if etag and keep_versions > 0:
+                self._record_version(conn, report_key, etag, rows, built_at, keep_versions, row_digests)
+
+    def _record_version(self, conn, report_key, etag, rows, created_at, keep_versions, row_digests=None):
+        known = conn.execute(
+            "SELECT 1 FROM report_versions WHERE report_key = ? AND etag = ?", (report_key, etag)
+        ).fetchone()
+        if known:
+            return  # mesmo conteúdo de uma versão já registrada
+        conn.execute("INSERT INTO report_versions (report_key, etag, created_at) VALUES (?, ?, ?)",
+                     (report_key, etag, created_at))
+        conn.executemany(
+            "INSERT OR REPLACE INTO report_version_rows (report_key, etag, person_id, row_hash) VALUES (?, ?, ?, ?)",
+            [(report_key, etag, row.get("ID Colaborador"), row_digest)
+             for row, row_digest in zip(rows, row_digests or map(report_row_digest, rows))
+             if row.get("ID Colaborador") is not None],
+        )
+        expired = [old_etag for (old_etag,) in conn.execute(
+            "SELECT etag FROM report_versions WHERE report_key = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+            (report_key, keep_versions),
+        )]
+        for old_etag in expired:
+            conn.execute("DELETE FROM report_version_rows WHERE report_key = ? AND etag = ?", (report_key, old_etag))
+            conn.execute("DELETE FROM report_versions WHERE report_key = ? AND etag = ?", (report_key, old_etag))
+
+    def version_row_hashes(self, report_key, etag):
+        """``person_id → hash da linha`` de uma versão do histórico, ou ``None`` se ela não existir (mais)."""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            known = conn.execute(
+                "SELECT 1 FROM report_versions WHERE report_key = ? AND etag = ?", (report_key, etag)
+            ).fetchone()
+            if not known:
+                return None
+            return dict(conn.execute(
+                "SELECT person_id, row_hash FROM report_version_rows WHERE report_key = ? AND etag = ?",
+                (report_key, etag),
+            ))
+        finally:
+            conn.commit()
+
+    def report_info(self, report_key, max_age=None):
+        """Metadados do relatório salvo (``None`` se ausente ou mais velho que ``max_age`` segundos)."""
+        row = self._connect().execute(
+            "SELECT built_at, row_count, etag FROM reports WHERE report_key = ?", (report_key,)
+        ).fetchone()
+        if row is None or (max_age is not None and time.time() - row[0] > max_age):
+            return None
+        return {"report_key": report_key, "built_at": row[0], "row_count": row[1], "etag": row[2]}
+
+    def load_report(self, report_key, max_age=None):
+        """Linhas do relatório salvo, na ordem original, ou ``None`` se ausente/vencido."""
+        conn = self._connect()
+        # Leitura dentro de uma transação: uma gravação concorrente não mistura versões.
+        conn.execute("BEGIN")
+        try:
+            if self.report_info(report_key, max_age) is None:
+                return None
+            return [
+                json.loads(payload)
+                for (payload,) in conn.execute(
+                    "SELECT payload FROM report_rows WHERE report_key = ? ORDER BY position", (report_key,)
+                )
+            ]
+        finally:
+            conn.commit()
+
+    def iter_report(self, report_key, max_age=None):
+        """
+        Como ``load_report``, mas devolve um gerador que lê as linhas sob demanda
+        (para respostas em streaming), ou ``None`` se o relatório estiver ausente/vencido.
+        """
+        if self.report_info(report_key, max_age) is None:
+            return None
+
+        def generate():
+            # Conexão própria: o gerador é consumido aos poucos, fora da transação de outras leituras.
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                conn.execute("BEGIN")
+                for (payload,) in conn.execute(
+                    "SELECT payload FROM report_rows WHERE report_key = ? ORDER BY position", (report_key,)
+                ):
+                    yield json.loads(payload)
+            finally:
+                conn.close()
+        return generate()
+
+    def query_report(self, report_key, filters=None, search=None, sort=None, descending=False,
+                     offset=0, limit=None, max_age=None):
+        """
+        Consulta indexada sobre um relatório salvo: ``filters`` (coluna → lista de valores
+        aceitos), busca livre em nome/CPF/matrícula, ordenação por uma coluna (nulos por
+        último, empate pela ordem original) e paginação. Devolve ``(total, linhas)`` ou
+        ``None`` se o relatório estiver ausente/vencido.
+        """
+        conditions, params = ["report_key = ?"], [report_key]
+        for column, accepted in (filters or {}).items():
+            if column not in REPORT_FILTERS:
+                raise ValueError(f"Filtro desconhecido: {column}")
+            conditions.append(f"{column} IN ({', '.join('?' * len(accepted))})")
+            params.extend(accepted)
+        if search:
+            conditions.append("instr(search_text, ?) > 0")
+            params.append(search.casefold())
+        where = " AND ".join(conditions)
+        order = "position"
+        if sort:
+            if sort not in REPORT_SORT_KEYS:
+                raise ValueError(f"Ordenação desconhecida: {sort}")
+            order = f"{sort} IS NULL, {sort} COLLATE NOCASE {'DESC' if descending else 'ASC'}, position"
+
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if self.report_info(report_key, max_age) is None:
+                return None
+            total = conn.execute(f"SELECT COUNT(*) FROM report_rows WHERE {where}", params).fetchone()[0]
+            rows = [
+                json.loads(payload)
+                for (payload,) in conn.execute(
+                    f"SELECT payload FROM report_rows WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                    [*params, -1 if limit is None else limit, offset],
+                )
+            ]
+            return total, rows
+        finally:
+            conn.commit()
+
+    def invalidate_reports(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM report_rows")
+            conn.execute("DELETE FROM reports")
+
+    # ------------------------------------------------------------------
+    # Jobs de relatório
+    # ------------------------------------------------------------------
+    def save_job(self, job_id, state, max_age=None):
+        """Grava o estado do job; jobs sem mudança há mais de ``max_age`` segundos são apagados."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO report_jobs (id, updated_at, state) VALUES (?, ?, ?)",
+                         (job_id, now, json.dumps(state, ensure_ascii=False)))
+            if max_age is not None:
+                conn.execute("DELETE FROM report_jobs WHERE updated_at < ?", (now - max_age,))
+
+    def load_job(self, job_id, max_age=None):
+        row = self._connect().execute("SELECT updated_at, state FROM report_jobs WHERE id = ?",
+                                      (job_id,)).fetchone()
+        if row is None or (max_age is not None and time.time() - row[0] > max_age):
+            return None
+        return json.loads(row[1])
+
+    # ------------------------------------------------------------------
+    # Gravação em segundo plano
+    # ------------------------------------------------------------------
+    def submit(self, method_name, *args, **kwargs):
+        """Agenda ``self.<method_name>(*args)`` no thread de gravação; qualquer falha gera aviso no log."""
+        def run():
+            try:
+                getattr(self, method_name)(*args, **kwargs)
+            except Exception as e:
+                # O Future não é lido por ninguém: sem este aviso a falha some.
+                print(f"  [AVISO] Falha ao gravar no armazenamento local ({method_name}): {e!r}")
+                raise
+        return self._writer.submit(run)
+
+
+def _open_store():
+    path = os.getenv("NEXTI_STORE_PATH")
+    if not path:
+        return None
+    try:
+        return NextiStore(path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"[AVISO] Armazenamento local da Nexti desativado: {e}")
+        return None
+
+
+# Instância única por processo (None quando desativado ou indisponível).
+nexti_store = _open_store()
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify, current_app, render_template_string
-from db import get_db_connection
+from db import get_request_connection, request_cursor
 from werkzeug.security import generate_password_hash
 import secrets
 from email_service import enviar_email 
@@ -16,25 +16,25 @@ def solicitar_recuperacao():
     if not email:
         return jsonify({'success': False, 'message': 'O campo email é obrigatório'}), 400
 
-    conn = get_db_connection()
+    conn = get_request_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Erro de conexão com o banco de dados'}), 500
     
-    cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT id, username, status FROM users WHERE email = %s", (email,))
-        user = cursor.fetchone()
+        with request_cursor() as cursor:
+            cursor.execute("SELECT id, username, status FROM users WHERE email = %s", (email,))
+            user = cursor.fetchone()
 
-        if not user or user['status'] != 'ativo':
-            return jsonify({
-                'success': True,
-                'message': 'Se um usuário com este e-mail existir e estiver ativo, um link de recuperação foi enviado.'
-            }), 200
+            if not user or user['status'] != 'ativo':
+                return jsonify({
+                    'success': True,
+                    'message': 'Se um usuário com este e-mail existir e estiver ativo, um link de recuperação foi enviado.'
+                }), 200
 
-        token_recuperacao = secrets.token_hex(32)
-        username = user['username']
+            token_recuperacao = secrets.token_hex(32)
+            username = user['username']
 
-        cursor.execute("UPDATE users SET recover = %s WHERE id = %s", (token_recuperacao, user['id']))
+            cursor.execute("UPDATE users SET recover = %s WHERE id = %s", (token_recuperacao, user['id']))
         conn.commit()
 
         frontend_url = current_app.config.get('FRONTEND_URL', 'https://paineltelaviv.bybrain.com.br')
@@ -128,8 +128,5 @@ def solicitar_recuperacao():
         conn.rollback()
         print(f"Erro ao solicitar recuperação: {e}")
         return jsonify({'success': False, 'message': 'Ocorreu um erro ao processar a solicitação.'}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
 
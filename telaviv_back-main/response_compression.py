@@ -0,0 +1,113 @@
+"""
+Compressão das respostas da API (gzip ou brotli), negociada pelo Accept-Encoding.
+
+Os relatórios da Nexti chegam a vários megabytes de JSON; comprimidos caem
+para cerca de um décimo. Respostas comuns só são comprimidas acima de
+COMPRESS_MIN_SIZE bytes. Respostas em streaming (NDJSON, array JSON em
+blocos, CSV) são comprimidas bloco a bloco, com flush a cada bloco, para o
+cliente continuar recebendo os dados enquanto o servidor os gera.
+
+O brotli é opcional: sem o pacote 'brotli' instalado, só gzip é oferecido.
+
+Configuração (variáveis de ambiente):
+    COMPRESS_MIN_SIZE        tamanho mínimo, em bytes, para comprimir (1024)
+    COMPRESS_LEVEL           nível do gzip, 1-9 (6)
+    COMPRESS_BROTLI_QUALITY  qualidade do brotli, 0-11 (4)
+"""
+import gzip
+import os
+import zlib
+
+from dotenv import load_dotenv
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pacote opcional
+    brotli = None
+
+load_dotenv()
+
+# Tipos que valem a pena comprimir. O SSE fica de fora: cada evento precisa chegar na hora.
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/csv",
+    "text/html",
+    "text/plain",
+}
+
+
+class ResponseCompression:
+    """Extensão Flask: ``compression.init_app(app)`` registra o after_request."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_MIN_SIZE", int(os.getenv("COMPRESS_MIN_SIZE", "1024")))
+        app.config.setdefault("COMPRESS_LEVEL", int(os.getenv("COMPRESS_LEVEL", "6")))
+        app.config.setdefault("COMPRESS_BROTLI_QUALITY", int(os.getenv("COMPRESS_BROTLI_QUALITY", "4")))
+        self.app = app
+        app.after_request(self._after_request)
+
+    def _after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (response.status_code < 200 or response.status_code >= 300 or response.status_code == 204
+                or response.direct_passthrough or "Content-Encoding" in response.headers
+                or "Range" in request.headers):
+            return response
+
+        offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+        encoding = request.accept_encodings.best_match(offered)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.app.config["COMPRESS_MIN_SIZE"]:
+                return response
+            response.set_data(self._compress(data, encoding))
+
+        response.headers["Content-Encoding"] = encoding
+        # O corpo comprimido não é byte a byte igual ao original: o ETag passa a ser fraco.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.app.config["COMPRESS_BROTLI_QUALITY"])
+        return gzip.compress(data, compresslevel=self.app.config["COMPRESS_LEVEL"])
+
+    def _compress_stream(self, chunks, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.app.config["COMPRESS_BROTLI_QUALITY"])
+            compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.app.config["COMPRESS_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+        def generate():
+            try:
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    if chunk:
+                        yield compress(chunk) + flush()
+                yield finish()
+            finally:
+                # Fecha o iterável original (libera conexões/arquivos do gerador da rota).
+                if hasattr(chunks, "close"):
+                    chunks.close()
+        return generate()
+
+
+compression = ResponseCompression()
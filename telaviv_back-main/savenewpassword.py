@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify, current_app
-from db import get_db_connection
+from db import get_request_connection, request_cursor
 from werkzeug.security import generate_password_hash
 from email_service import enviar_email # Seu serviço de e-mail
 
@@ -17,27 +17,27 @@ def savenewpassword():
     if len(password) < 8:
         return jsonify({'success': False, 'message': 'A nova senha deve ter pelo menos 8 caracteres.'}), 400
 
-    conn = get_db_connection()
+    conn = get_request_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Erro de conexão com o banco de dados'}), 500
 
-    cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT id, username, email FROM users WHERE recover = %s", (token,))
-        user = cursor.fetchone()
+        with request_cursor() as cursor:
+            cursor.execute("SELECT id, username, email FROM users WHERE recover = %s", (token,))
+            user = cursor.fetchone()
 
-        if not user:
-            return jsonify({'success': False, 'message': 'Token de recuperação inválido ou expirado.'}), 404
+            if not user:
+                return jsonify({'success': False, 'message': 'Token de recuperação inválido ou expirado.'}), 404
 
-        senha_hash = generate_password_hash(password)
-        user_id = user['id']
-        username = user['username']
-        email = user['email']
+            senha_hash = generate_password_hash(password)
+            user_id = user['id']
+            username = user['username']
+            email = user['email']
 
-        cursor.execute(
-            "UPDATE users SET password = %s, recover = NULL WHERE id = %s",
-            (senha_hash, user_id)
-        )
+            cursor.execute(
+                "UPDATE users SET password = %s, recover = NULL WHERE id = %s",
+                (senha_hash, user_id)
+            )
         conn.commit()
 
         assunto = "Sua senha foi alterada com sucesso!"
@@ -84,7 +84,4 @@ def savenewpassword():
     except Exception as err:
         conn.rollback()
         print(f"Erro ao redefinir senha: {err}")
-        return jsonify({'success': False, 'message': 'Ocorreu um erro ao processar sua solicitação.'}), 500
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        return jsonify({'success': False, 'message': 'Ocorreu um erro ao processar sua solicitação.'}), 500
\ No newline at end of file
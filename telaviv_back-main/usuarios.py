@@ -6,7 +6,7 @@ from pathlib import Path
 from flask import Blueprint, request, jsonify, g, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash
-from db import get_db_connection
+from db import get_request_connection, request_cursor
 from mail_config import mail                       # Flask‑Mail já configurado na app
 from email_service import enviar_email            # Função já existente (ver abaixo)
 
@@ -92,15 +92,14 @@ def role_required(perfis_permitidos):
     """
     Verifica se o usuário autenticado possui um dos perfis permitidos.
     Também disponibiliza ``g.user`` (id, username, role) para uso nas rotas.
+    A consulta usa a conexão da requisição, a mesma que a rota vai usar
+    (um único slot do pool por requisição).
     """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             user_id = get_jwt_identity()
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-
-            try:
+            with request_cursor() as cursor:
                 cursor.execute(
                     """
                     SELECT u.id, u.username, p.perfil AS role
@@ -112,20 +111,17 @@ def role_required(perfis_permitidos):
                 )
                 user = cursor.fetchone()
 
-                if not user:
-                    return jsonify({"msg": "Usuário não encontrado"}), 404
+            if not user:
+                return jsonify({"msg": "Usuário não encontrado"}), 404
 
-                if user["role"] not in perfis_permitidos:
-                    return (
-                        jsonify({"msg": "Acesso não autorizado para este perfil"}),
-                        403,
-                    )
+            if user["role"] not in perfis_permitidos:
+                return (
+                    jsonify({"msg": "Acesso não autorizado para este perfil"}),
+                    403,
+                )
 
-                g.user = user
-                return f(*args, **kwargs)
-            finally:
-                cursor.close()
-                conn.close()
+            g.user = user
+            return f(*args, **kwargs)
         return decorated_function
     return decorator
 
@@ -141,10 +137,7 @@ def role_required(perfis_permitidos):
 @jwt_required()
 def get_usuarios():
     user_id = get_jwt_identity()
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    try:
+    with request_cursor() as cursor:
         # Busca o próprio usuário para preencher ``g.user``
         cursor.execute(
             """
@@ -226,9 +219,6 @@ def get_usuarios():
             "totalPaginas": total_paginas,
             "paginaAtual": page
         })
-    finally:
-        cursor.close()
-        conn.close()
 
 
 # --------------------------------------------------------------
@@ -237,18 +227,13 @@ def get_usuarios():
 @usuario_bp.route('/api/usuarios/perfis', methods=['GET'])
 @jwt_required()
 def get_perfis():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    try:
-        cursor.execute("SELECT perfil FROM perfil_users ORDER BY perfil")
-        perfis = [row['perfil'] for row in cursor.fetchall()]
-        return jsonify(perfis)
-    except Exception as e:
-        return jsonify({"msg": f"Erro ao buscar perfis: {e}"}), 500
-    finally:
-        cursor.close()
-        conn.close()
+    with request_cursor() as cursor:
+        try:
+            cursor.execute("SELECT perfil FROM perfil_users ORDER BY perfil")
+            perfis = [row['perfil'] for row in cursor.fetchall()]
+            return jsonify(perfis)
+        except Exception as e:
+            return jsonify({"msg": f"Erro ao buscar perfis: {e}"}), 500
 
 
 # --------------------------------------------------------------
@@ -269,10 +254,8 @@ def create_user():
     if not all([username, email, role]):
         return jsonify({"msg": "Campos obrigatórios ausentes"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    try:
+    conn = get_request_connection()
+    with request_cursor() as cursor:
         # Verifica e‑mail duplicado
         cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
         if cursor.fetchone():
@@ -341,9 +324,6 @@ def create_user():
         return jsonify({
             "msg": "Usuário criado com sucesso. A senha foi enviada por e‑mail."
         }), 201
-    finally:
-        cursor.close()
-        conn.close()
 
 
 # --------------------------------------------------------------
@@ -360,10 +340,8 @@ def update_user(user_id):
     role = data.get('role')
     status = data.get('status')
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    try:
+    conn = get_request_connection()
+    with request_cursor() as cursor:
         # Busca o usuário que será editado (para checar hierarquia)
         cursor.execute(
             """
@@ -470,9 +448,6 @@ def update_user(user_id):
         conn.commit()
 
         return jsonify({"msg": "Usuário atualizado com sucesso"}), 200
-    finally:
-        cursor.close()
-        conn.close()
 
 
 # --------------------------------------------------------------
@@ -488,9 +463,6 @@ def get_logs():
         offset = (page - 1) * per_page
         busca = request.args.get('busca', '')
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
         # Filtro de busca (texto livre na coluna mensagem)
         where_clause = "1=1"
         params = []
@@ -503,24 +475,25 @@ def get_logs():
             WHERE {where_clause}
         """
 
-        # Total de linhas (para paginação)
-        count_query = f"SELECT COUNT(id) AS total {base_query}"
-        cursor.execute(count_query, tuple(params))
-        total = cursor.fetchone()["total"]
-
-        # Dados paginados
-        query_params = list(params) + [per_page, offset]
-        data_query = f"""
-            SELECT id,
-                   mensagem,
-                   data_cadastro,
-                   update_cadastro
-            {base_query}
-            ORDER BY data_cadastro DESC
-            LIMIT %s OFFSET %s
-        """
-        cursor.execute(data_query, tuple(query_params))
-        logs = cursor.fetchall()
+        with request_cursor() as cursor:
+            # Total de linhas (para paginação)
+            count_query = f"SELECT COUNT(id) AS total {base_query}"
+            cursor.execute(count_query, tuple(params))
+            total = cursor.fetchone()["total"]
+
+            # Dados paginados
+            query_params = list(params) + [per_page, offset]
+            data_query = f"""
+                SELECT id,
+                       mensagem,
+                       data_cadastro,
+                       update_cadastro
+                {base_query}
+                ORDER BY data_cadastro DESC
+                LIMIT %s OFFSET %s
+            """
+            cursor.execute(data_query, tuple(query_params))
+            logs = cursor.fetchall()
 
         # Serializa datas ISO‑8601
         for log in logs:
@@ -538,10 +511,4 @@ def get_logs():
 
     except Exception as e:
         print(f"Erro ao buscar logs: {e}")
-        return jsonify({"msg": "Erro interno ao buscar logs"}), 500
-    finally:
-        # Fechamento seguro de recursos
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn.is_connected():
-            conn.close()
\ No newline at end of file
+        return jsonify({"msg": "Erro interno ao buscar logs"}), 500
\ No newline at end of file
@@ -1,10 +1,11 @@
 import React, { useState, useEffect, useRef } from "react";
-import ExcelJS from "exceljs";
 import { saveAs } from "file-saver";
 import Alert from "@alert";
 import UrlAtual from "@urlAtual";
 import "./Nexti.css";
 
+const JOB_POLL_INTERVAL_MS = 1000;
+
 const Nexti = () => {
   const [startDate, setStartDate] = useState("");
   const [finishDate, setFinishDate] = useState("");
@@ -13,74 +14,18 @@ const Nexti = () => {
   const [searchPerformed, setSearchPerformed] = useState(false);
   const [logOutput, setLogOutput] = useState("");
   const [progress, setProgress] = useState(0);
+  const [reportPayload, setReportPayload] = useState({});
+  const [downloading, setDownloading] = useState(false);
   const logContainerRef = useRef(null);
-  const logIntervalRef = useRef(null);
-  const progressIntervalRef = useRef(null);
-  const logTemplates = [
-    "INFO: Iniciando verificação de cache...",
-    "API: GET /persons/all?page={_}",
-    "CACHE: OK - 'Persons' cache populado.",
-    "API: GET /workplaces/all?page={_}",
-    "CACHE: OK - 'Workplaces' cache populado.",
-    "DEBUG: Mapeando {n} colaboradores...",
-    "API: GET /clients/all?page={_}",
-    "CACHE: OK - 'Clients' cache populado.",
-    "INFO: Processando dados de colaborador ID: {id}",
-    "API: GET /companies/all?page={_}",
-    "CACHE: OK - 'Companies' cache populado.",
-    "INFO: Validando situação do colaborador ID: {id}",
-    "API: GET /scheduletransfers/lastupdate/...",
-    "CACHE: OK - 'ScheduleTransfers' cache populado.",
-    "WARN: Latência detectada na API. Tentando novamente...",
-    "DEBUG: Cruzando dados de posto de trabalho.",
-    "INFO: Gerando linha para o relatório...",
-    "INFO: Normalizando dados de horário...",
-    "DEBUG: Colaborador ID {id} processado com sucesso.",
-  ];
+  const pollingCancelledRef = useRef(false);
 
   useEffect(() => {
-    const startLoadingAnimation = () => {
-      setLogOutput(">>> Iniciando processo de geração de relatório...\n");
-      setProgress(0);
-      const addLogEntry = () => {
-        if (logTemplates.length === 0) return;
-
-        const randomIndex = Math.floor(Math.random() * logTemplates.length);
-        let logText = logTemplates[randomIndex]
-          .replace("{_}", Math.floor(Math.random() * 10))
-          .replace("{n}", Math.floor(Math.random() * 100) + 300)
-          .replace("{id}", Math.floor(Math.random() * 9000) + 1000);
-        setLogOutput((prev) => prev + logText + "\n");
-        const randomDelay = Math.random() * (150 - 40) + 40;
-        logIntervalRef.current = setTimeout(addLogEntry, randomDelay);
-      };
-      addLogEntry();
-      progressIntervalRef.current = setInterval(() => {
-        setProgress((prev) => {
-          if (prev >= 98) return 98;
-          return prev + 2;
-        });
-      }, 600);
-    };
-
-    const stopLoadingAnimation = () => {
-      clearTimeout(logIntervalRef.current);
-      clearInterval(progressIntervalRef.current);
-      setProgress(100);
-      setLogOutput((prev) => prev + ">>> Processo finalizado com sucesso!");
-    };
-
-    if (loading) {
-      startLoadingAnimation();
-    } else {
-      stopLoadingAnimation();
-    }
-
+    // Interrompe o acompanhamento do job se o usuário sair da página.
+    pollingCancelledRef.current = false;
     return () => {
-      clearTimeout(logIntervalRef.current);
-      clearInterval(progressIntervalRef.current);
+      pollingCancelledRef.current = true;
     };
-  }, [loading]);
+  }, []);
 
   useEffect(() => {
     if (logContainerRef.current) {
@@ -88,6 +33,56 @@ const Nexti = () => {
     }
   }, [logOutput]);
 
+  // Agenda o job e acompanha o progresso até o resultado. Devolve as linhas, null se o
+  // servidor não conhece o job (404) ou undefined se o usuário saiu da página.
+  const runReportJob = async (payload, authHeaders) => {
+    const submitResponse = await fetch(`${UrlAtual()}/api/nexti/jobs`, {
+      method: "POST",
+      headers: authHeaders,
+      body: JSON.stringify(payload),
+    });
+    if (submitResponse.status === 404) return null;
+    let job = await submitResponse.json();
+    if (!submitResponse.ok) {
+      throw new Error(job.error || "Ocorreu um erro ao iniciar o relatório.");
+    }
+    setLogOutput((prev) => prev + job.log.join("\n") + (job.log.length ? "\n" : ""));
+
+    let logOffset = job.log_offset;
+    while (job.status !== "done" && job.status !== "error") {
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+      if (pollingCancelledRef.current) return undefined;
+      const statusResponse = await fetch(
+        `${UrlAtual()}/api/nexti/jobs/${job.job_id}?log_offset=${logOffset}`,
+        { headers: authHeaders }
+      );
+      if (statusResponse.status === 404) return null;
+      job = await statusResponse.json();
+      if (!statusResponse.ok) {
+        throw new Error(job.error || "Não foi possível acompanhar o relatório.");
+      }
+      logOffset = job.log_offset;
+      if (job.log.length) {
+        setLogOutput((prev) => prev + job.log.join("\n") + "\n");
+      }
+      setProgress(job.progress);
+    }
+    if (job.status === "error") {
+      throw new Error(job.error || "Ocorreu um erro ao buscar os dados.");
+    }
+
+    const response = await fetch(
+      `${UrlAtual()}/api/nexti/jobs/${job.job_id}/result`,
+      { headers: authHeaders }
+    );
+    if (response.status === 404) return null;
+    const data = await response.json();
+    if (!response.ok) {
+      throw new Error(data.error || "Ocorreu um erro ao buscar os dados.");
+    }
+    return data;
+  };
+
   const handleGenerateReport = async () => {
     if ((startDate && !finishDate) || (!startDate && finishDate)) {
       alert.warning(
@@ -127,22 +122,35 @@ const Nexti = () => {
         finish: finishDate.split("-").reverse().join("") + "235959",
       };
     }
+    setReportPayload(payload);
+    const authHeaders = {
+      "Content-Type": "application/json",
+      Authorization: `Bearer ${token}`,
+    };
+    setLogOutput(">>> Iniciando processo de geração de relatório...\n");
+    setProgress(0);
     try {
-      const response = await fetch(
-        `${UrlAtual()}/api/nexti/colaboradores_data`,
-        {
+      // O relatório roda em segundo plano no servidor; aqui só acompanhamos o progresso real.
+      let data = await runReportJob(payload, authHeaders);
+      if (data === undefined) return;
+      if (data === null) {
+        // Job desconhecido para o worker que respondeu (vários workers sem armazenamento
+        // compartilhado, ou servidor sem threads em segundo plano): pede o relatório direto.
+        setLogOutput(
+          (prev) => prev + ">>> Acompanhamento indisponível; gerando o relatório diretamente...\n"
+        );
+        const response = await fetch(`${UrlAtual()}/api/nexti/colaboradores_data`, {
           method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-            Authorization: `Bearer ${token}`,
-          },
+          headers: authHeaders,
           body: JSON.stringify(payload),
+        });
+        data = await response.json();
+        if (!response.ok) {
+          throw new Error(data.error || "Ocorreu um erro ao buscar os dados.");
         }
-      );
-      const data = await response.json();
-      if (!response.ok) {
-        throw new Error(data.error || "Ocorreu um erro ao buscar os dados.");
       }
+      setProgress(100);
+      setLogOutput((prev) => prev + ">>> Processo finalizado com sucesso!");
 
       // --- AJUSTE APLICADO AQUI: ADICIONANDO A DATA E HORA ---
       const now = new Date();
@@ -178,67 +186,37 @@ const Nexti = () => {
       alert.warning("Não há dados para exportar.");
       return;
     }
+    const token = localStorage.getItem("access_token");
+    if (!token) {
+      alert.warning("Sessão expirada. Por favor, faça login novamente.");
+      return;
+    }
 
-    const workbook = new ExcelJS.Workbook();
-    const worksheet = workbook.addWorksheet("Colaboradores");
-
-    // --- AJUSTE APLICADO AQUI: ADICIONANDO A COLUNA NO EXCEL ---
-    worksheet.columns = [
-      { header: "Hora", key: "Hora", width: 20 },
-      { header: "Empresa", key: "Razao Social Empresa", width: 35 },
-      { header: "Cliente", key: "Cliente", width: 35 },
-      { header: "Negócio", key: "Unidade de Negocio", width: 25 },
-      { header: "Posto", key: "Nome Posto de Trabalho", width: 35 },
-      { header: "Colaborador", key: "Nome Colaborador", width: 35 },
-      { header: "Matrícula", key: "Matricula", width: 15 },
-      { header: "CPF", key: "CPF", width: 20 },
-      { header: "Cargo", key: "Descricao Cargo", width: 25 },
-      { header: "Cronograma", key: "Cronograma", width: 20 },
-      { header: "Horário", key: "Horario", width: 20 },
-      { header: "Turno", key: "Turno", width: 25 },
-    ];
-
-    worksheet.addRows(tableData);
-
-    worksheet.getRow(1).eachCell((cell) => {
-      cell.font = { name: "Sans-Serif", size: 10, bold: true };
-      cell.fill = {
-        type: "pattern",
-        pattern: "solid",
-        fgColor: { argb: "9fc5e8" },
-      };
-      cell.border = {
-        top: { style: "thin", color: { argb: "000000" } },
-        left: { style: "thin", color: { argb: "000000" } },
-        bottom: { style: "thin", color: { argb: "000000" } },
-        right: { style: "thin", color: { argb: "000000" } },
-      };
-    });
-
-    worksheet.eachRow({ includeEmpty: true }, (row, rowNumber) => {
-      if (rowNumber > 1) {
-        row.eachCell({ includeEmpty: true }, (cell) => {
-          cell.font = { name: "Sans-Serif", size: 8, bold: false };
-          cell.border = {
-            top: { style: "thin", color: { argb: "000000" } },
-            left: { style: "thin", color: { argb: "000000" } },
-            bottom: { style: "thin", color: { argb: "000000" } },
-            right: { style: "thin", color: { argb: "000000" } },
-          };
-        });
+    // A planilha é gerada no servidor (mesmo período do relatório exibido).
+    setDownloading(true);
+    try {
+      const response = await fetch(
+        `${UrlAtual()}/api/nexti/colaboradores_export?format=xlsx`,
+        {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            Authorization: `Bearer ${token}`,
+          },
+          body: JSON.stringify(reportPayload),
+        }
+      );
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error || "Não foi possível gerar a planilha.");
       }
-    });
-
-    worksheet.autoFilter = {
-      from: "A1",
-      to: { row: 1, column: worksheet.columns.length },
-    };
-
-    const buffer = await workbook.xlsx.writeBuffer();
-    const blob = new Blob([buffer], {
-      type: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    });
-    saveAs(blob, "Relatorio_Colaboradores_Nexti.xlsx");
+      const blob = await response.blob();
+      saveAs(blob, "Relatorio_Colaboradores_Nexti.xlsx");
+    } catch (error) {
+      alert.warning(`Erro: ${error.message}`);
+    } finally {
+      setDownloading(false);
+    }
   };
 
   return (
@@ -323,8 +301,12 @@ const Nexti = () => {
           <div className="card-header d-flex justify-content-between align-items-center">
             <h5>Resultados Encontrados ({tableData.length})</h5>
             {tableData.length > 0 && (
-              <button className="btn btn-success" onClick={handleDownloadExcel}>
-                Download Excel
+              <button
+                className="btn btn-success"
+                onClick={handleDownloadExcel}
+                disabled={downloading}
+              >
+                {downloading ? "Gerando..." : "Download Excel"}
               </button>
             )}
           </div>